@@ -0,0 +1,920 @@
+bl_info = {
+    "name": "notester32's Bone Tool",
+    "description": "Tool for adjusting bones in Blender 3",
+    "author": "notester32",
+    "version": (1, 8),
+    "blender": (3, 6, 0),
+    "category": "Rigging",
+}
+
+import functools
+import sys
+import time
+
+import bpy
+from .core import (
+    ADJUSTMENT_ENDS,
+    PLAN_CACHE,
+    PROFILER,
+    AdjustmentPlan,
+    DeltaJournal,
+    RecordWriter,
+    SkeletonSnapshot,
+    adjustment_steps,
+    align_to_reference,
+    apply_recipe,
+    all_bones_plan,
+    all_bones_plan_steps,
+    apply_plan,
+    descendants_plan_steps,
+    fan_out_plan,
+    finish,
+    guard_bones,
+    log_profiles,
+    mirror_adjustment,
+    mirror_plan,
+    moved_bones,
+    moved_subtrees,
+    multi_adjustment_steps,
+    snap_to_nearest_joints,
+    summarize,
+)
+
+# The journals of the last adjustments of every armature, newest last
+JOURNALS = {}
+JOURNAL_DEPTH = 16
+
+# (settings, ArmatureSummary) of every armature for the panel, dropped when the armature changes
+SUMMARIES = {}
+
+# (settings, SkeletonSnapshot) of every armature as Live Re-apply last left it
+LIVE = {}
+
+# Moved bones whose names and parents Live Re-apply checks one by one,
+# with more it reads all the bones again
+LIVE_CHECKED_BONES = 256
+
+# Seconds of work per timer event when running in the background
+STEP_TIME = 0.02
+
+def profiled(execute):
+    """Profiles execute while "Profile" is on, the last profile stays in PROFILER.last"""
+    @functools.wraps(execute)
+    def profiled_execute(self, context):
+        if not context.scene.adjust_bones_profile:
+            return execute(self, context)
+        log_profiles()
+        with PROFILER.run(self.bl_idname):
+            return execute(self, context)
+    return profiled_execute
+
+def edit_armatures(context):
+    """The armature objects in Edit Mode, one per armature"""
+    objects = {}
+    for obj in context.objects_in_mode:
+        if obj.type == 'ARMATURE':
+            objects.setdefault(obj.data, obj)
+    PLAN_CACHE.fit(len(objects))
+    return list(objects.values())
+
+def adjust_edit_bones(context, armature, snapshot, plan, dry_run=False, bones=None):
+    scene = context.scene
+    if scene.adjust_bones_mirror:
+        plan = mirror_plan(snapshot, plan)
+    apply_plan(snapshot, plan, scene.adjust_bones_reconnect, bones)
+    guarded = guard_bones(snapshot, scene.adjust_bones_guard, plan.target_end)
+    unpaired = mirror_adjustment(snapshot, plan.targets) if scene.adjust_bones_mirror else plan.targets[:0]
+    journal = snapshot.pending_journal() if dry_run else snapshot.write_edit_bones(armature.edit_bones)
+    journal.guarded = [snapshot.names[bone] for bone in guarded.tolist()]
+    journal.unpaired = [snapshot.names[bone] for bone in unpaired.tolist()]
+    return journal
+
+def add_journal(armature, journal):
+    SUMMARIES.pop(armature.name, None)
+    journals = JOURNALS.setdefault(armature.name, [])
+    journals.append(journal)
+    del journals[:-JOURNAL_DEPTH]
+
+def report_modified(operator, results):
+    """Keeps the journals of the (armature, journal) results and reports the adjusted bones"""
+    guarded = bone_labels([(armature, journal.guarded) for armature, journal in results])
+    report_names(operator, guarded, "%d bones would collapse or flip (see Guard): %s%s")
+    unpaired = bone_labels([(armature, journal.unpaired) for armature, journal in results])
+    report_names(operator, unpaired, "%d adjusted bones have no mirror bone: %s%s")
+    if operator.dry_run:
+        return report_dry_run(operator, results)
+
+    results = [(armature, journal) for armature, journal in results if len(journal)]
+    # Nothing changed, cancel so no undo step is pushed
+    if not results:
+        operator.report({'INFO'}, "All bones are already adjusted.")
+        return {'CANCELLED'}
+
+    for armature, journal in results:
+        add_journal(armature, journal)
+    bones = sum(len(journal) for _, journal in results)
+    if len(results) == 1:
+        operator.report({'INFO'}, "Adjusted %d bones." % bones)
+    else:
+        operator.report({'INFO'}, "Adjusted %d bones in %d armatures." % (bones, len(results)))
+    return {'FINISHED'}
+
+def report_dry_run(operator, results):
+    """Streams the records of the pending journals to the dry run file, or the system console"""
+    path = bpy.path.abspath(operator.dry_run_path) if operator.dry_run_path else ""
+    try:
+        stream = open(path, "w") if path else sys.stdout
+    except OSError as error:
+        operator.report({'WARNING'}, "Could not write the dry run: %s" % error)
+        return {'CANCELLED'}
+    writer = RecordWriter(stream, as_array=path.lower().endswith(".json"))
+    try:
+        for armature, journal in results:
+            for record in journal.records(armature=armature.name):
+                writer.write(record)
+    finally:
+        writer.close()
+        if path:
+            stream.close()
+
+    # Nothing was changed, so no undo step is pushed
+    operator.report({'INFO'}, "Dry run: %d bones would be adjusted." % writer.count)
+    return {'CANCELLED'}
+
+def armature_summary(context, obj):
+    """Returns the ArmatureSummary of the armature in Edit Mode, only reading it again after a change"""
+    scene = context.scene
+    settings = (
+        scene.adjust_bones_mode,
+        scene.adjust_bones_reconnect,
+        scene.adjust_bones_through_branches,
+        scene.adjust_bones_guard,
+        scene.adjust_bones_mirror,
+    )
+    cached = SUMMARIES.get(obj.data.name)
+    if cached is not None and cached[0] == settings:
+        return cached[1]
+
+    mode, reconnect, through_branches, guard, mirror = settings
+    snapshot = SkeletonSnapshot.from_edit_bones(obj.data.edit_bones)
+    summary = summarize(snapshot, all_bones_plan(snapshot, mode, through_branches), reconnect, guard, mirror)
+    SUMMARIES[obj.data.name] = (settings, summary)
+    return summary
+
+@bpy.app.handlers.persistent
+def forget_changed_summaries(scene, depsgraph):
+    for update in depsgraph.updates:
+        if isinstance(update.id, bpy.types.Armature):
+            SUMMARIES.pop(update.id.name, None)
+
+@bpy.app.handlers.persistent
+def forget_file(*_):
+    """Drops what is kept per armature name once another file is loaded, its armatures are not the same"""
+    JOURNALS.clear()
+    SUMMARIES.clear()
+    LIVE.clear()
+
+@bpy.app.handlers.persistent
+def reapply_live(scene, depsgraph):
+    """With Live Re-apply, runs Apply to All Bones again below the bones moved in the armatures in Edit Mode"""
+    if not scene.adjust_bones_live:
+        LIVE.clear()
+        return
+    updated = {update.id.name for update in depsgraph.updates if isinstance(update.id, bpy.types.Armature)}
+    for obj in scene.objects:
+        if obj.type == 'ARMATURE' and obj.mode == 'EDIT' and obj.data.name in updated:
+            reapply_armature(bpy.context, obj.data)
+
+def reapply_armature(context, armature):
+    """Adjusts the bones that moved since the last call and their descendants, then keeps the result to compare with.
+
+    While the armature keeps its bone count, only the heads, tails and
+    connect flags are read again and the names and parents come from the
+    last snapshot. They are read again when an update moved nothing (like
+    renaming or re-parenting with Keep Offset), changed a connect flag, or
+    moved a bone whose name or parent changed, and the moved bones are
+    adjusted on the new hierarchy.
+    """
+    scene = context.scene
+    settings = (scene.adjust_bones_mode, scene.adjust_bones_reconnect, scene.adjust_bones_through_branches)
+    edit_bones = armature.edit_bones
+    last = LIVE.get(armature.name)
+    # A new armature, new settings or new bones start over from the bones as they are
+    if last is None or last[0] != settings or len(last[1]) != len(edit_bones):
+        LIVE[armature.name] = (settings, SkeletonSnapshot.from_edit_bones(edit_bones))
+        PLAN_CACHE.fit(len(LIVE))
+        return
+
+    last = last[1]
+    snapshot = SkeletonSnapshot.from_edit_bones_like(edit_bones, last)
+    moved = moved_bones(snapshot, last).nonzero()[0]
+    if (
+        len(moved) == 0
+        or len(moved) > LIVE_CHECKED_BONES
+        or (snapshot.connect != last.connect).any()
+        or not snapshot.topology_matches(edit_bones, moved)
+    ):
+        snapshot = SkeletonSnapshot.from_edit_bones(edit_bones)
+    LIVE[armature.name] = (settings, snapshot)
+
+    mode, _, through_branches = settings
+    bones = moved_subtrees(snapshot, last, through_branches)
+    if len(bones):
+        adjust_edit_bones(context, armature, snapshot, all_bones_plan(snapshot, mode, through_branches), bones=bones)
+
+def report_names(operator, names, message):
+    """Warns about the bones in names, listing the first few"""
+    if names:
+        names = sorted(names)
+        operator.report({'WARNING'}, message % (
+            len(names), ", ".join(names[:5]), ", ..." if len(names) > 5 else ""
+        ))
+
+def bone_labels(named):
+    """The bone names of the (armature, names) pairs, as armature/bone when there are several armatures"""
+    if len(named) > 1:
+        return ["%s/%s" % (armature.name, name) for armature, names in named for name in names]
+    return [name for _, names in named for name in names]
+
+def split_names(text):
+    """The comma separated parts of a name list property"""
+    return [part.strip() for part in text.split(",") if part.strip()]
+
+def last_journal(obj):
+    journals = JOURNALS.get(obj.data.name) if obj and obj.type == 'ARMATURE' else None
+    return journals[-1] if journals else None
+
+class DryRunProperties:
+    dry_run: bpy.props.BoolProperty(
+        name="Dry Run",
+        description="Only write JSON records of the bones that would change, without changing them",
+        default=False
+    )
+    dry_run_path: bpy.props.StringProperty(
+        name="Records File",
+        description="NDJSON file (or .json for a JSON array) for the dry run records, the system console when empty",
+        default="",
+        subtype='FILE_PATH'
+    )
+
+class AdjustBonesOperator(DryRunProperties, bpy.types.Operator):
+    """Adjusts the head or tail of the 2 selected bones, or of all selected bones from the active one"""
+    bl_idname = "armature.adjust_bones"
+    bl_label = "Apply Adjustment"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    @profiled
+    def execute(self, context):
+        obj = bpy.context.object
+        if obj and obj.type == 'ARMATURE' and obj.mode == 'EDIT':
+            selected_bones = {}
+            for bone in bpy.context.selected_editable_bones:
+                selected_bones.setdefault(bone.id_data, []).append(bone)
+            if context.scene.adjust_bones_from_active:
+                return self.fan_out(context, selected_bones)
+            pairs = [(armature, bones) for armature, bones in selected_bones.items() if len(bones) == 2]
+
+            if not pairs:
+                self.report({'WARNING'}, "You must select exactly 2 bones.")
+                return {'CANCELLED'}
+
+            results = []
+            for armature, (first_bone, target_bone) in pairs:
+                snapshot = SkeletonSnapshot.from_edit_bones(armature.edit_bones)
+                with PROFILER.phase("plan"):
+                    plan = AdjustmentPlan.compile(
+                        len(snapshot),
+                        [snapshot.index[first_bone.name]],
+                        [snapshot.index[target_bone.name]],
+                        context.scene.adjust_bones_mode,
+                    )
+                results.append((armature, adjust_edit_bones(context, armature, snapshot, plan, self.dry_run)))
+            return report_modified(self, results)
+
+        self.report({'WARNING'}, "You must be in Edit Mode with an armature selected.")
+        return {'CANCELLED'}
+
+    def fan_out(self, context, selected_bones):
+        """Adjusts every selected bone from the active bone of its armature, all of them in one plan"""
+        groups = []
+        for armature, bones in selected_bones.items():
+            active = armature.edit_bones.active
+            if active is not None and active.select and len(bones) > 1:
+                groups.append((armature, active.name, [bone.name for bone in bones]))
+
+        if not groups:
+            self.report({'WARNING'}, "You must select the active bone and at least one other bone.")
+            return {'CANCELLED'}
+
+        results = []
+        for armature, source, targets in groups:
+            snapshot = SkeletonSnapshot.from_edit_bones(armature.edit_bones)
+            with PROFILER.phase("plan"):
+                plan = fan_out_plan(snapshot, source, targets, context.scene.adjust_bones_mode)
+            results.append((armature, adjust_edit_bones(context, armature, snapshot, plan, self.dry_run)))
+        return report_modified(self, results)
+
+class ChunkedAdjustment:
+    """Runs the steps of make_steps at once, or spread over timer events with "Run in Background".
+
+    make_steps returns the (object, steps) pairs of the armatures to adjust.
+    An armature is only written by its last step and the written ones are
+    reverted on Esc, so cancelling leaves every armature as it was.
+    """
+
+    @profiled
+    def execute(self, context):
+        obj = bpy.context.object
+        if obj and obj.type == 'ARMATURE' and obj.mode == 'EDIT':
+            jobs = self.make_steps(context, obj)
+            if jobs is None:
+                return {'CANCELLED'}
+            return self.report_jobs(jobs, finish(self.chain(jobs)))
+
+        self.report({'WARNING'}, "You must be in Edit Mode with an armature selected.")
+        return {'CANCELLED'}
+
+    def invoke(self, context, event):
+        if not context.scene.adjust_bones_background:
+            return self.execute(context)
+
+        obj = bpy.context.object
+        if obj and obj.type == 'ARMATURE' and obj.mode == 'EDIT':
+            self.jobs = self.make_steps(context, obj, verify=True)
+            if self.jobs is None:
+                return {'CANCELLED'}
+
+            if context.scene.adjust_bones_profile:
+                log_profiles()
+                PROFILER.start(self.bl_idname)
+            self.steps = self.chain(self.jobs)
+            self.counts = [len(job_obj.data.edit_bones) for job_obj, _ in self.jobs]
+            window_manager = context.window_manager
+            self.timer = window_manager.event_timer_add(STEP_TIME, window=context.window)
+            window_manager.progress_begin(0.0, 1.0)
+            window_manager.modal_handler_add(self)
+            return {'RUNNING_MODAL'}
+
+        self.report({'WARNING'}, "You must be in Edit Mode with an armature selected.")
+        return {'CANCELLED'}
+
+    def modal(self, context, event):
+        if event.type == 'ESC':
+            self.stop(context)
+            self.report({'INFO'}, "Adjustment cancelled, nothing was changed.")
+            return {'CANCELLED'}
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+
+        # Leaving Edit Mode or deleting bones changes the bones the steps write
+        changed = [
+            job_obj.mode != 'EDIT' or len(job_obj.data.edit_bones) != count
+            for (job_obj, _), count in zip(self.jobs, self.counts)
+        ]
+        if any(changed):
+            self.stop(context)
+            self.report({'WARNING'}, "The armature changed while it was being adjusted.")
+            return {'CANCELLED'}
+
+        deadline = time.perf_counter() + STEP_TIME
+        try:
+            progress = next(self.steps)
+            while time.perf_counter() < deadline:
+                progress = next(self.steps)
+        except StopIteration as stop:
+            self.stop(context)
+            return self.report_jobs(self.jobs, stop.value)
+        except ValueError as error:
+            self.stop(context)
+            self.report({'WARNING'}, str(error))
+            return {'CANCELLED'}
+
+        context.window_manager.progress_update(progress)
+        if context.workspace:
+            context.workspace.status_text_set("Adjusting bones: %d%% (Esc to cancel)" % (progress * 100))
+        return {'RUNNING_MODAL'}
+
+    def stop(self, context):
+        context.window_manager.event_timer_remove(self.timer)
+        context.window_manager.progress_end()
+        if context.workspace:
+            context.workspace.status_text_set(None)
+        self.steps.close()
+        PROFILER.stop()
+
+    @staticmethod
+    def chain(jobs):
+        return multi_adjustment_steps([(job_obj.data.edit_bones, steps) for job_obj, steps in jobs])
+
+    def report_jobs(self, jobs, journals):
+        return report_modified(self, [(job_obj.data, journal) for (job_obj, _), journal in zip(jobs, journals)])
+
+class ApplyAllBonesOperator(ChunkedAdjustment, DryRunProperties, bpy.types.Operator):
+    """Applies the adjustment to all bones of every armature in Edit Mode"""
+    bl_idname = "armature.apply_all_bones"
+    bl_label = "Apply to All Bones"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    def make_steps(self, context, obj, verify=False):
+        mode = context.scene.adjust_bones_mode
+        reconnect = context.scene.adjust_bones_reconnect
+        through_branches = context.scene.adjust_bones_through_branches
+        return [
+            (edit_obj, adjustment_steps(
+                edit_obj.data.edit_bones,
+                lambda snapshot: all_bones_plan_steps(snapshot, mode, through_branches),
+                reconnect,
+                verify,
+                self.dry_run,
+                context.scene.adjust_bones_guard,
+                context.scene.adjust_bones_mirror,
+            ))
+            for edit_obj in edit_armatures(context)
+        ]
+
+class ApplyAllBonesFromBoneOperator(ChunkedAdjustment, DryRunProperties, bpy.types.Operator):
+    """Applies adjustments to all descendant bones from the selected bone"""
+    bl_idname = "armature.apply_all_bones_from_bone"
+    bl_label = "Apply From Selected Bone"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    def make_steps(self, context, obj, verify=False):
+        selected_bones = [bone for bone in bpy.context.selected_editable_bones if bone.id_data == obj.data]
+
+        if len(selected_bones) != 1:
+            self.report({'WARNING'}, "Select exactly one bone as the starting point.")
+            return None
+
+        root_name = selected_bones[0].name
+        mode = context.scene.adjust_bones_mode
+        leaf_first = context.scene.adjust_bones_leaf_first
+        return [(obj, adjustment_steps(
+            obj.data.edit_bones,
+            lambda snapshot: descendants_plan_steps(snapshot, snapshot.index[root_name], mode, leaf_first),
+            context.scene.adjust_bones_reconnect,
+            verify,
+            self.dry_run,
+            context.scene.adjust_bones_guard,
+            context.scene.adjust_bones_mirror,
+        ))]
+
+class SnapToNearestJointOperator(DryRunProperties, bpy.types.Operator):
+    """Snaps the end of every bone to the nearest joint of another bone, for imports with broken parenting"""
+    bl_idname = "armature.snap_to_nearest_joint"
+    bl_label = "Snap to Nearest Joint"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    @profiled
+    def execute(self, context):
+        obj = bpy.context.object
+        if obj and obj.type == 'ARMATURE' and obj.mode == 'EDIT':
+            results = []
+            reparented = 0
+            for edit_obj in edit_armatures(context):
+                edit_bones = edit_obj.data.edit_bones
+                snapshot = SkeletonSnapshot.from_edit_bones(edit_bones)
+                mode = context.scene.adjust_bones_mode
+                bones = snap_to_nearest_joints(
+                    snapshot,
+                    mode,
+                    context.scene.adjust_bones_snap_tolerance,
+                    context.scene.adjust_bones_snap_reparent,
+                    context.scene.adjust_bones_reconnect,
+                )
+                guarded = guard_bones(snapshot, context.scene.adjust_bones_guard, ADJUSTMENT_ENDS[mode][0])
+                if self.dry_run:
+                    journal = snapshot.pending_journal()
+                else:
+                    # New parents are not journaled, Undo takes them back
+                    snapshot.write_parents(edit_bones, bones)
+                    reparented += len(bones)
+                    journal = snapshot.write_edit_bones(edit_bones)
+                journal.guarded = [snapshot.names[bone] for bone in guarded.tolist()]
+                results.append((edit_obj.data, journal))
+
+            result = report_modified(self, results)
+            if reparented:
+                self.report({'INFO'}, "Re-parented %d bones." % reparented)
+                return {'FINISHED'}
+            return result
+
+        self.report({'WARNING'}, "You must be in Edit Mode with an armature selected.")
+        return {'CANCELLED'}
+
+class AlignToReferenceOperator(DryRunProperties, bpy.types.Operator):
+    """Aligns every bone of the armatures in Edit Mode to the bone of the same name in the reference armature"""
+    bl_idname = "armature.align_to_reference"
+    bl_label = "Align to Reference"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    @profiled
+    def execute(self, context):
+        obj = bpy.context.object
+        if obj and obj.type == 'ARMATURE' and obj.mode == 'EDIT':
+            scene = context.scene
+            reference = scene.adjust_bones_reference
+            if reference is None or reference.type != 'ARMATURE':
+                self.report({'WARNING'}, "Choose a reference armature.")
+                return {'CANCELLED'}
+
+            # Outside Edit Mode the edit bones of the reference do not exist, its rest pose is read
+            if reference.mode == 'EDIT':
+                reference_snapshot = SkeletonSnapshot.from_edit_bones(reference.data.edit_bones)
+            else:
+                reference_snapshot = SkeletonSnapshot.from_bones(reference.data.bones)
+
+            results = []
+            unmatched = []
+            for edit_obj in edit_armatures(context):
+                if edit_obj.data == reference.data:
+                    continue
+                edit_bones = edit_obj.data.edit_bones
+                snapshot = SkeletonSnapshot.from_edit_bones(edit_bones)
+                bones = align_to_reference(
+                    snapshot,
+                    reference_snapshot,
+                    scene.adjust_bones_mode,
+                    scene.adjust_bones_reconnect,
+                    split_names(scene.adjust_bones_strip_prefixes),
+                    split_names(scene.adjust_bones_strip_suffixes),
+                )
+                unmatched.append((edit_obj.data, [snapshot.names[bone] for bone in bones.tolist()]))
+                guarded = guard_bones(snapshot, scene.adjust_bones_guard, ADJUSTMENT_ENDS[scene.adjust_bones_mode][0])
+                journal = snapshot.pending_journal() if self.dry_run else snapshot.write_edit_bones(edit_bones)
+                journal.guarded = [snapshot.names[bone] for bone in guarded.tolist()]
+                results.append((edit_obj.data, journal))
+
+            if not results:
+                self.report({'WARNING'}, "The reference is the only armature in Edit Mode.")
+                return {'CANCELLED'}
+            report_names(self, bone_labels(unmatched), "%d bones have no match in the reference: %s%s")
+            return report_modified(self, results)
+
+        self.report({'WARNING'}, "You must be in Edit Mode with an armature selected.")
+        return {'CANCELLED'}
+
+class RecipeFileProperties:
+    filepath: bpy.props.StringProperty(
+        name="File Path",
+        description="The .npz recipe file",
+        default="",
+        subtype='FILE_PATH'
+    )
+    filter_glob: bpy.props.StringProperty(default="*.npz", options={'HIDDEN'})
+
+    def invoke(self, context, event):
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+class ExportRecipeOperator(RecipeFileProperties, bpy.types.Operator):
+    """Saves the head, tail and connect values of the bones by name, to replay them on re-exports of the rig"""
+    bl_idname = "armature.export_recipe"
+    bl_label = "Export Recipe"
+    bl_options = {'REGISTER'}
+
+    only_adjusted: bpy.props.BoolProperty(
+        name="Only Adjusted Bones",
+        description="Only save the bones changed by the adjustments of this session",
+        default=False
+    )
+
+    @profiled
+    def execute(self, context):
+        obj = bpy.context.object
+        if obj and obj.type == 'ARMATURE' and obj.mode == 'EDIT':
+            if not self.filepath:
+                self.report({'WARNING'}, "Choose a file for the recipe.")
+                return {'CANCELLED'}
+
+            names = None
+            if self.only_adjusted:
+                names = sorted({name for journal in JOURNALS.get(obj.data.name, ()) for name in journal.names})
+            recipe = SkeletonSnapshot.from_edit_bones(obj.data.edit_bones).recipe(names)
+            path = bpy.path.ensure_ext(bpy.path.abspath(self.filepath), ".npz")
+            recipe.save(path)
+            self.report({'INFO'}, "Saved %d bones to %s." % (len(recipe), path))
+            return {'FINISHED'}
+
+        self.report({'WARNING'}, "You must be in Edit Mode with an armature selected.")
+        return {'CANCELLED'}
+
+class ApplyRecipeOperator(RecipeFileProperties, DryRunProperties, bpy.types.Operator):
+    """Sets the bones of every armature in Edit Mode to their values in a recipe, matched by name"""
+    bl_idname = "armature.apply_recipe"
+    bl_label = "Apply Recipe"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    @profiled
+    def execute(self, context):
+        obj = bpy.context.object
+        if obj and obj.type == 'ARMATURE' and obj.mode == 'EDIT':
+            try:
+                recipe = DeltaJournal.load(bpy.path.abspath(self.filepath))
+            except (OSError, ValueError) as error:
+                self.report({'WARNING'}, "Could not read the recipe: %s" % error)
+                return {'CANCELLED'}
+
+            results = []
+            unmatched = []
+            for edit_obj in edit_armatures(context):
+                journal, missing = apply_recipe(
+                    edit_obj.data.edit_bones, recipe, self.dry_run, context.scene.adjust_bones_guard
+                )
+                unmatched.append((edit_obj.data, missing))
+                results.append((edit_obj.data, journal))
+
+            report_names(self, bone_labels(unmatched), "%d recipe bones not found: %s%s")
+            return report_modified(self, results)
+
+        self.report({'WARNING'}, "You must be in Edit Mode with an armature selected.")
+        return {'CANCELLED'}
+
+class ToggleAdjustmentOperator(bpy.types.Operator):
+    """Switches the bones of the last adjustment between their old and adjusted positions"""
+    bl_idname = "armature.toggle_adjustment"
+    bl_label = "Toggle Before/After"
+    bl_options = {'REGISTER'}
+
+    @profiled
+    def execute(self, context):
+        obj = bpy.context.object
+        if obj and obj.type == 'ARMATURE' and obj.mode == 'EDIT':
+            journal = last_journal(obj)
+            if journal is None:
+                self.report({'WARNING'}, "There is no adjustment to toggle.")
+                return {'CANCELLED'}
+
+            journal.write(obj.data.edit_bones, not journal.applied)
+            SUMMARIES.pop(obj.data.name, None)
+            LIVE.pop(obj.data.name, None)
+            self.report({'INFO'}, "Showing the bones %s the adjustment." % ("after" if journal.applied else "before"))
+            return {'FINISHED'}
+
+        self.report({'WARNING'}, "You must be in Edit Mode with an armature selected.")
+        return {'CANCELLED'}
+
+class RevertAdjustmentOperator(bpy.types.Operator):
+    """Puts the bones of the last adjustment back where they were and forgets it"""
+    bl_idname = "armature.revert_adjustment"
+    bl_label = "Revert Last Adjustment"
+    bl_options = {'REGISTER'}
+
+    @profiled
+    def execute(self, context):
+        obj = bpy.context.object
+        if obj and obj.type == 'ARMATURE' and obj.mode == 'EDIT':
+            journal = last_journal(obj)
+            if journal is None:
+                self.report({'WARNING'}, "There is no adjustment to revert.")
+                return {'CANCELLED'}
+
+            journal.write(obj.data.edit_bones, after=False)
+            SUMMARIES.pop(obj.data.name, None)
+            LIVE.pop(obj.data.name, None)
+            JOURNALS[obj.data.name].pop()
+            self.report({'INFO'}, "Reverted %d bones." % len(journal))
+            return {'FINISHED'}
+
+        self.report({'WARNING'}, "You must be in Edit Mode with an armature selected.")
+        return {'CANCELLED'}
+
+class ReplayAdjustmentOperator(bpy.types.Operator):
+    """Applies the last adjustment of the active armature to the other armatures in Edit Mode"""
+    bl_idname = "armature.replay_adjustment"
+    bl_label = "Replay on Other Armatures"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    @profiled
+    def execute(self, context):
+        obj = bpy.context.object
+        if obj and obj.type == 'ARMATURE' and obj.mode == 'EDIT':
+            journal = last_journal(obj)
+            others = [other for other in context.objects_in_mode if other.type == 'ARMATURE' and other.data != obj.data]
+            if journal is None or not others:
+                self.report({'WARNING'}, "Adjust the active armature and edit the others together with it.")
+                return {'CANCELLED'}
+
+            missing = 0
+            for other in others:
+                snapshot = SkeletonSnapshot.from_edit_bones(other.data.edit_bones)
+                missing += len(journal.apply(snapshot))
+                replayed = snapshot.write_edit_bones(other.data.edit_bones)
+                if len(replayed):
+                    add_journal(other.data, replayed)
+
+            self.report({'INFO'}, "Replayed on %d armatures, %d bones not found." % (len(others), missing))
+            return {'FINISHED'}
+
+        self.report({'WARNING'}, "You must be in Edit Mode with an armature selected.")
+        return {'CANCELLED'}
+
+class BoneToolPanel(bpy.types.Panel):
+    bl_label = "notester32's Bone Tool"
+    bl_idname = "VIEW3D_PT_bone_tool"
+    bl_space_type = 'VIEW_3D'
+    bl_region_type = 'UI'
+    bl_category = "Bone Tools"
+
+    def draw(self, context):
+        layout = self.layout
+        layout.label(text="Select 2 bones and apply adjustments:")
+
+        layout.prop(context.scene, "adjust_bones_mode", text="Mode")
+        layout.prop(context.scene, "adjust_bones_reconnect", text="Reconnect")
+        layout.prop(context.scene, "adjust_bones_from_active", text="Active to All Selected")
+        layout.prop(context.scene, "adjust_bones_guard", text="Guard")
+        layout.prop(context.scene, "adjust_bones_mirror", text="Mirror X")
+        layout.prop(context.scene, "adjust_bones_background", text="Run in Background")
+        layout.prop(context.scene, "adjust_bones_profile", text="Profile")
+        
+        layout.operator("armature.adjust_bones", text="Apply Adjustment")
+        layout.separator()
+        layout.prop(context.scene, "adjust_bones_through_branches", text="Through Branches")
+        layout.operator("armature.apply_all_bones", text="Apply to All Bones")
+        layout.prop(context.scene, "adjust_bones_live", text="Live Re-apply")
+        layout.prop(context.scene, "adjust_bones_leaf_first", text="Leaf First")
+        layout.operator("armature.apply_all_bones_from_bone", text="Apply From Selected Bone")
+        layout.separator()
+        layout.prop(context.scene, "adjust_bones_snap_tolerance", text="Tolerance")
+        layout.prop(context.scene, "adjust_bones_snap_reparent", text="Re-parent")
+        layout.operator("armature.snap_to_nearest_joint", text="Snap to Nearest Joint")
+        layout.separator()
+        layout.prop(context.scene, "adjust_bones_reference", text="Reference")
+        layout.prop(context.scene, "adjust_bones_strip_prefixes", text="Strip Prefixes")
+        layout.prop(context.scene, "adjust_bones_strip_suffixes", text="Strip Suffixes")
+        layout.operator("armature.align_to_reference", text="Align to Reference")
+
+        obj = context.object
+        if obj and obj.type == 'ARMATURE' and obj.mode == 'EDIT':
+            summary = armature_summary(context, obj)
+            layout.separator()
+            layout.label(text="Bones: %d, roots: %d" % (summary.bones, summary.roots))
+            layout.label(text="Chains: %d, branch points: %d" % (summary.chains, summary.branch_points))
+            if summary.zero_length:
+                layout.label(text="Zero-length bones: %d" % summary.zero_length, icon='ERROR')
+            if summary.collapsing:
+                layout.label(text="Apply to All Bones would collapse or flip %d bones" % summary.collapsing, icon='ERROR')
+            if summary.pending:
+                layout.label(text="Apply to All Bones would move %d bones" % summary.pending)
+                layout.label(text="    up to %.4f (%s)" % (summary.largest_move, summary.largest_bone))
+            else:
+                layout.label(text="Apply to All Bones has nothing to move")
+
+        journal = last_journal(context.object)
+        if journal is not None:
+            layout.separator()
+            state = "adjusted" if journal.applied else "original"
+            layout.label(text="Last adjustment: %d bones (%s)" % (len(journal), state))
+            layout.operator("armature.toggle_adjustment", text="Toggle Before/After")
+            layout.operator("armature.revert_adjustment", text="Revert Last Adjustment")
+            layout.operator("armature.replay_adjustment", text="Replay on Other Armatures")
+
+        layout.separator()
+        layout.operator("armature.export_recipe", text="Export Recipe")
+        layout.operator("armature.apply_recipe", text="Apply Recipe")
+
+        profile = PROFILER.last
+        if context.scene.adjust_bones_profile and profile:
+            layout.separator()
+            layout.label(text="Last run: %s, %.1f ms" % (profile["name"], profile["wall_time"] * 1000.0))
+            for phase, seconds in profile["phases"].items():
+                layout.label(text="    %s: %.2f ms" % (phase, seconds * 1000.0))
+            for counter, value in profile["counters"].items():
+                layout.label(text="    %s: %d" % (counter, value))
+
+def register():
+    bpy.utils.register_class(AdjustBonesOperator)
+    bpy.utils.register_class(ApplyAllBonesOperator)
+    bpy.utils.register_class(ApplyAllBonesFromBoneOperator)
+    bpy.utils.register_class(SnapToNearestJointOperator)
+    bpy.utils.register_class(AlignToReferenceOperator)
+    bpy.utils.register_class(ExportRecipeOperator)
+    bpy.utils.register_class(ApplyRecipeOperator)
+    bpy.utils.register_class(ToggleAdjustmentOperator)
+    bpy.utils.register_class(RevertAdjustmentOperator)
+    bpy.utils.register_class(ReplayAdjustmentOperator)
+    bpy.utils.register_class(BoneToolPanel)
+    bpy.app.handlers.depsgraph_update_post.append(forget_changed_summaries)
+    bpy.app.handlers.depsgraph_update_post.append(reapply_live)
+    bpy.app.handlers.load_post.append(forget_file)
+    bpy.types.Scene.adjust_bones_mode = bpy.props.EnumProperty(
+        name="Adjustment Mode",
+        description="Choose which part of the bone to move",
+        items=[
+            ("head_to_tail", "Head → Tail", "Move the head of the Target Bone to the tail of the First Bone"),
+            ("tail_to_head", "Tail → Head", "Move the tail of the Target Bone to the head of the First Bone"),
+            ("head_to_head", "Head → Head", "Move the head of the Target Bone to the head of the First Bone"),
+            ("tail_to_tail", "Tail → Tail", "Move the tail of the Target Bone to the tail of the First Bone"),
+        ],
+        default="head_to_tail"
+    )
+    bpy.types.Scene.adjust_bones_reconnect = bpy.props.BoolProperty(
+        name="Reconnect",
+        description="Reconnect the bone after adjustment",
+        default=False
+    )
+    bpy.types.Scene.adjust_bones_from_active = bpy.props.BoolProperty(
+        name="Active to All Selected",
+        description="Apply Adjustment moves every selected bone to the active bone instead of a pair of bones",
+        default=False
+    )
+    bpy.types.Scene.adjust_bones_guard = bpy.props.EnumProperty(
+        name="Guard",
+        description="What to do with bones an adjustment would make zero-length or turn around",
+        items=[
+            ("skip", "Skip", "Leave those bones as they were"),
+            ("keep_length", "Keep Length", "Move the other end of those bones back to their original length"),
+            ("report", "Report Only", "Adjust them anyway and list them, Blender deletes zero-length bones"),
+        ],
+        default="skip"
+    )
+    bpy.types.Scene.adjust_bones_mirror = bpy.props.BoolProperty(
+        name="Mirror X",
+        description="Adjust the bones on one side (.L/.R names or mirrored positions) and mirror them to the other",
+        default=False
+    )
+    bpy.types.Scene.adjust_bones_leaf_first = bpy.props.BoolProperty(
+        name="Leaf First",
+        description="Adjust the deepest bones first, so every bone is adjusted from its parent's original position",
+        default=False
+    )
+    bpy.types.Scene.adjust_bones_through_branches = bpy.props.BoolProperty(
+        name="Through Branches",
+        description="Also adjust the child that best continues the direction of a bone with several children",
+        default=False
+    )
+    bpy.types.Scene.adjust_bones_live = bpy.props.BoolProperty(
+        name="Live Re-apply",
+        description="Run Apply to All Bones again below every bone moved in Edit Mode, only on the bones it affects",
+        default=False
+    )
+    bpy.types.Scene.adjust_bones_snap_tolerance = bpy.props.FloatProperty(
+        name="Snap Tolerance",
+        description="How far a bone end may be from a joint to snap to it",
+        default=0.01,
+        min=1e-6,
+        subtype='DISTANCE'
+    )
+    bpy.types.Scene.adjust_bones_snap_reparent = bpy.props.BoolProperty(
+        name="Re-parent",
+        description="Make every bone a child of the bone it snapped to (Head → Tail mode)",
+        default=False
+    )
+    bpy.types.Scene.adjust_bones_reference = bpy.props.PointerProperty(
+        name="Reference",
+        description="The clean armature whose bones Align to Reference copies, matched by name",
+        type=bpy.types.Object,
+        poll=lambda scene, obj: obj.type == 'ARMATURE'
+    )
+    bpy.types.Scene.adjust_bones_strip_prefixes = bpy.props.StringProperty(
+        name="Strip Prefixes",
+        description="Comma separated prefixes ignored when matching bone names, like mixamorig:",
+        default=""
+    )
+    bpy.types.Scene.adjust_bones_strip_suffixes = bpy.props.StringProperty(
+        name="Strip Suffixes",
+        description="Comma separated suffixes ignored when matching bone names, like _end",
+        default=""
+    )
+    bpy.types.Scene.adjust_bones_background = bpy.props.BoolProperty(
+        name="Run in Background",
+        description="Adjust large armatures in small steps with a progress bar, Esc cancels without changing anything",
+        default=False
+    )
+    bpy.types.Scene.adjust_bones_profile = bpy.props.BoolProperty(
+        name="Profile",
+        description="Time every phase of the operators, show the last run here and log every run to the system console",
+        default=False
+    )
+
+def unregister():
+    bpy.utils.unregister_class(AdjustBonesOperator)
+    bpy.utils.unregister_class(ApplyAllBonesOperator)
+    bpy.utils.unregister_class(ApplyAllBonesFromBoneOperator)
+    bpy.utils.unregister_class(SnapToNearestJointOperator)
+    bpy.utils.unregister_class(AlignToReferenceOperator)
+    bpy.utils.unregister_class(ExportRecipeOperator)
+    bpy.utils.unregister_class(ApplyRecipeOperator)
+    bpy.utils.unregister_class(ToggleAdjustmentOperator)
+    bpy.utils.unregister_class(RevertAdjustmentOperator)
+    bpy.utils.unregister_class(ReplayAdjustmentOperator)
+    bpy.utils.unregister_class(BoneToolPanel)
+    bpy.app.handlers.depsgraph_update_post.remove(forget_changed_summaries)
+    bpy.app.handlers.depsgraph_update_post.remove(reapply_live)
+    bpy.app.handlers.load_post.remove(forget_file)
+    forget_file()
+    del bpy.types.Scene.adjust_bones_mode
+    del bpy.types.Scene.adjust_bones_reconnect
+    del bpy.types.Scene.adjust_bones_from_active
+    del bpy.types.Scene.adjust_bones_guard
+    del bpy.types.Scene.adjust_bones_mirror
+    del bpy.types.Scene.adjust_bones_leaf_first
+    del bpy.types.Scene.adjust_bones_through_branches
+    del bpy.types.Scene.adjust_bones_live
+    del bpy.types.Scene.adjust_bones_snap_tolerance
+    del bpy.types.Scene.adjust_bones_snap_reparent
+    del bpy.types.Scene.adjust_bones_reference
+    del bpy.types.Scene.adjust_bones_strip_prefixes
+    del bpy.types.Scene.adjust_bones_strip_suffixes
+    del bpy.types.Scene.adjust_bones_background
+    del bpy.types.Scene.adjust_bones_profile
@@ -0,0 +1,1685 @@
+"""Bone adjustment engine of notester32's Bone Tool.
+
+Nothing in here uses bpy: the skeleton is read from and written to any
+collection with foreach_get/foreach_set (like Armature.edit_bones) or
+built from plain BoneRecord tuples, so the engine also runs, and can be
+tested and profiled, outside Blender with n32bt_fakebpy standing in for
+the bpy the add-on package imports.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from functools import cached_property
+
+import numpy as np
+
+# (target end, source end) for every adjustment mode, 0 = head and 1 = tail
+ADJUSTMENT_ENDS = {
+    "head_to_tail": (0, 1),
+    "tail_to_head": (1, 0),
+    "head_to_head": (0, 0),
+    "tail_to_tail": (1, 1),
+}
+
+# Position changes up to this distance are not written back
+WRITE_TOLERANCE = 1e-5
+
+# Version of the .npz recipes written by DeltaJournal.save
+RECIPE_FORMAT = 1
+
+# The attributes read for the heads and tails of edit bones and of rest pose bones
+EDIT_ENDS = ("head", "tail")
+REST_ENDS = ("head_local", "tail_local")
+
+# How far off the mirrored position a bone may be to pair it without a side in its name,
+# or to be a center bone
+MIRROR_TOLERANCE = 1e-3
+
+# Names with a side, like hand.L, hand_r.001, L_hand or LeftHand (Blender's naming conventions)
+SIDE_SUFFIX = re.compile(r"^(.*[._\- ])([LRlr])((?:\.\d+)?)$")
+SIDE_PREFIX = re.compile(r"^([LRlr])([._\- ].*)$")
+SIDE_WORD = re.compile(r"left|right", re.IGNORECASE)
+FLIPPED_SIDES = {"L": "R", "R": "L", "l": "r", "r": "l"}
+
+# Bones shorter than this are zero-length for Blender
+MIN_BONE_LENGTH = 1e-6
+
+# What guard_bones does with the bones an adjustment collapses or flips
+GUARD_POLICIES = ("skip", "keep_length", "report")
+DEFAULT_GUARD = "skip"
+
+# Threads for the compute of large forests, split by root subtree, and
+# the bones a skeleton needs before it is split
+WORKERS = os.cpu_count() or 1
+PARALLEL_MIN_BONES = 50000
+
+# Bones (or pairs) handled by one step of a step generator
+STEP_SIZE = 2048
+
+LOG = logging.getLogger(__name__)
+
+# Points a leaf of a PointTree holds at most
+TREE_LEAF_SIZE = 8
+
+# One bone as plain values, parent is the name of the parent bone or None
+BoneRecord = namedtuple("BoneRecord", "name parent head tail use_connect")
+
+# What summarize finds out about an armature, largest_move is how far the
+# end of largest_bone would move
+ArmatureSummary = namedtuple(
+    "ArmatureSummary",
+    "bones roots chains branch_points zero_length pending largest_move largest_bone collapsing",
+)
+
+class PhaseTimer:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        phases = self.profiler.phases
+        phases[self.name] = phases.get(self.name, 0.0) + time.perf_counter() - self.started
+
+class Profiler:
+    """Wall time per phase and counters of the current run, only taken while a run is on.
+
+    Phases and counters add up, so a phase can be timed once per step. With
+    no run on, phase returns a shared do-nothing context and count returns
+    at once, so the engine pays close to nothing for them.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.name = None
+        self.started = 0.0
+        self.phases = {}
+        self.counters = {}
+        # The profile of the last run, see stop
+        self.last = None
+
+    def start(self, name):
+        self.enabled = True
+        self.name = name
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.counters = {}
+
+    def stop(self):
+        """Ends the run, logs its profile and returns it as a JSON ready dict"""
+        if not self.enabled:
+            return self.last
+        self.enabled = False
+        self.last = {
+            "name": self.name,
+            "wall_time": time.perf_counter() - self.started,
+            "phases": self.phases,
+            "counters": self.counters,
+        }
+        LOG.info(
+            "%s: %.2f ms (%s) %s",
+            self.name,
+            self.last["wall_time"] * 1000.0,
+            ", ".join("%s %.2f ms" % (phase, seconds * 1000.0) for phase, seconds in self.phases.items()),
+            ", ".join("%s %d" % counter for counter in self.counters.items()),
+        )
+        return self.last
+
+    @contextmanager
+    def run(self, name):
+        self.start(name)
+        try:
+            yield self
+        finally:
+            self.stop()
+
+    def phase(self, name):
+        return PhaseTimer(self, name) if self.enabled else NO_PHASE
+
+    def count(self, name, value):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+NO_PHASE = nullcontext()
+PROFILER = Profiler()
+
+def log_profiles():
+    """Makes the profiles PROFILER logs show up, on stderr (Blender's system console) unless LOG already has a handler.
+
+    Python only shows warnings of a logger nobody configured, so without
+    this the INFO lines of the profiles go nowhere.
+    """
+    if not LOG.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(name)s: %(message)s"))
+        LOG.addHandler(handler)
+    LOG.setLevel(logging.INFO)
+
+class BoneHierarchy:
+    """Parent to children adjacency of a skeleton, stored as index arrays"""
+
+    def __init__(self, parents):
+        count = len(parents)
+        children = np.flatnonzero(parents >= 0)
+        self.parents = parents
+        self.roots = np.flatnonzero(parents < 0)
+        self.child_counts = np.bincount(parents[children], minlength=count)
+        self.child_offsets = np.zeros(count + 1, dtype=np.intp)
+        np.cumsum(self.child_counts, out=self.child_offsets[1:])
+        # Grouped by parent, siblings keep the order of the edit bones like bone.children
+        self.child_indices = children[np.argsort(parents[children], kind="stable")]
+
+    def children(self, bone):
+        return self.child_indices[self.child_offsets[bone]:self.child_offsets[bone + 1]]
+
+class BoneChains:
+    """A skeleton split into maximal linear chains and the branch points between them.
+
+    A chain starts at a root or at a bone whose parent does not have exactly
+    one child, and runs down through single children. bones holds the chains
+    one after the other from top to bottom, chain c being
+    bones[offsets[c]:offsets[c + 1]].
+    """
+
+    def __init__(self, hierarchy):
+        parents = hierarchy.parents
+        count = len(parents)
+        bones = np.arange(count)
+        starts = parents < 0
+        starts[~starts] = hierarchy.child_counts[parents[~starts]] != 1
+
+        # List ranking: every bone jumps to the start of its chain, counting the steps
+        above = np.where(starts, bones, parents)
+        positions = (~starts).astype(np.intp)
+        for _ in range(count.bit_length() + 1):
+            jumped = above[above]
+            if np.array_equal(jumped, above):
+                break
+            positions += positions[above]
+            above = jumped
+
+        self.hierarchy = hierarchy
+        self.heads = np.flatnonzero(starts)
+        self.bones = bones[np.lexsort((positions, above))]
+        self.offsets = np.zeros(len(self.heads) + 1, dtype=np.intp)
+        np.cumsum(np.bincount(above, minlength=count)[self.heads], out=self.offsets[1:])
+        self.chain_of = np.searchsorted(self.heads, above)
+        # Where every bone sits in its chain, 0 for the heads
+        self.positions = positions
+        self.branch_points = np.flatnonzero(hierarchy.child_counts > 1)
+
+    def __len__(self):
+        return len(self.heads)
+
+    def chain(self, chain):
+        return self.bones[self.offsets[chain]:self.offsets[chain + 1]]
+
+    def linked_bones(self):
+        """Returns the bones inside a chain, which are the only children of their parent"""
+        return np.flatnonzero(self.positions > 0)
+
+    @cached_property
+    def preorder(self):
+        """(bones, starts, ends): the bones depth first, the subtree of bone b being bones[starts[b]:ends[b]]"""
+        hierarchy = self.hierarchy
+        order = []
+        pending = self.chain_of[hierarchy.roots][::-1].tolist()
+        while pending:
+            chain = pending.pop()
+            order.append(chain)
+            pending.extend(self.chain_of[hierarchy.children(self.bones[self.offsets[chain + 1] - 1])][::-1].tolist())
+
+        # Every chain is followed by the chains below it, so their bones add up from the bottom
+        sizes = np.diff(self.offsets)
+        below = sizes.copy()
+        parent_chains = np.where(hierarchy.parents[self.heads] >= 0, self.chain_of[hierarchy.parents[self.heads]], -1)
+        for chain in reversed(order):
+            if parent_chains[chain] >= 0:
+                below[parent_chains[chain]] += below[chain]
+        order = np.array(order, dtype=np.intp)
+        chain_starts = np.empty(len(self), dtype=np.intp)
+        chain_starts[order] = np.cumsum(sizes[order]) - sizes[order]
+
+        starts = chain_starts[self.chain_of] + self.positions
+        ends = chain_starts[self.chain_of] + below[self.chain_of]
+        bones = np.empty_like(starts)
+        bones[starts] = np.arange(len(starts))
+        return bones, starts, ends
+
+    def walk_below(self, root):
+        """Yields the bones below root as arrays, one chain (or the rest of root's chain) at a time"""
+        chain = self.chain_of[root]
+        pending = [self.bones[self.offsets[chain] + self.positions[root] + 1:self.offsets[chain + 1]]]
+        ends = [self.bones[self.offsets[chain + 1] - 1]]
+        yield pending.pop()
+        while ends:
+            for chain in self.chain_of[self.hierarchy.children(ends.pop())].tolist():
+                yield self.chain(chain)
+                ends.append(self.bones[self.offsets[chain + 1] - 1])
+
+class SubtreeGroups:
+    """The root subtrees of a skeleton dealt into groups of about the same number of bones.
+
+    order lists the bones group by group (None when the bones already come
+    group by group), so the bones of group g are order[bounds[g]:bounds[g + 1]]
+    and arrays taken in that order split into the groups by slicing. positions
+    is where every bone sits in that order, and parents the parent of every
+    bone in that order as a position within its group.
+    """
+
+    def __init__(self, hierarchy, groups):
+        parents = hierarchy.parents
+        count = len(parents)
+        bones = np.arange(count)
+        root_of = np.where(parents < 0, bones, parents)
+        for _ in range(count.bit_length() + 1):
+            jumped = root_of[root_of]
+            if np.array_equal(jumped, root_of):
+                break
+            root_of = jumped
+
+        # Roots go to the group their first bone falls in when the bones are cut into equal groups
+        roots = hierarchy.roots
+        sizes = np.bincount(root_of, minlength=count)[roots]
+        root_groups = np.zeros(count, dtype=np.intp)
+        root_groups[roots] = np.minimum((np.cumsum(sizes) - sizes) * groups // count, groups - 1)
+
+        self.group_of = root_groups[root_of]
+        self.order = np.argsort(self.group_of, kind="stable")
+        self.bounds = np.searchsorted(self.group_of[self.order], np.arange(groups + 1))
+        self.positions = np.empty(count, dtype=np.intp)
+        self.positions[self.order] = bones
+        ordered_parents = parents[self.order]
+        starts = self.bounds[self.group_of[self.order]]
+        self.parents = np.where(ordered_parents >= 0, self.positions[ordered_parents] - starts, -1)
+        if np.array_equal(self.order, bones):
+            self.order = None
+
+    def __len__(self):
+        return len(self.bounds) - 1
+
+class SkeletonSnapshot:
+    """Array copy of the edit bones of an armature.
+
+    The heads, tails and connect arrays are replaced rather than changed in
+    place, so the arrays last read from or written to the edit bones stay
+    around to find out what changed.
+    """
+
+    def __init__(self, names, heads, tails, parents, connect, index=None):
+        self.names = names
+        self.index = {name: i for i, name in enumerate(names)} if index is None else index
+        self.heads = heads
+        self.tails = tails
+        self.parents = parents
+        self.connect = connect
+        self.stored = (heads, tails, connect)
+
+    def __len__(self):
+        return len(self.names)
+
+    @cached_property
+    def hierarchy(self):
+        return BoneHierarchy(self.parents)
+
+    @cached_property
+    def chains(self):
+        """The BoneChains of the hierarchy, shared by every snapshot of the same topology"""
+        return PLAN_CACHE.get((self.topology_key, "chains"), lambda: BoneChains(self.hierarchy))
+
+    def subtree_groups(self, groups):
+        """The SubtreeGroups of the hierarchy, shared by every snapshot of the same topology"""
+        return PLAN_CACHE.get((self.topology_key, "subtrees", groups), lambda: SubtreeGroups(self.hierarchy, groups))
+
+    @cached_property
+    def mirror(self):
+        """The mirror_index of the bones as they were first asked for"""
+        return mirror_index(self)
+
+    @cached_property
+    def topology_key(self):
+        """Digest of the bone names and parents, equal for rigs with the same hierarchy"""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update("\0".join(self.names).encode())
+        digest.update(self.parents.astype(np.int32).tobytes())
+        return digest.hexdigest()
+
+    @classmethod
+    def from_edit_bones(cls, edit_bones):
+        return finish(cls.read_steps(edit_bones))
+
+    @classmethod
+    def from_bones(cls, bones):
+        """Reads the rest pose of an armature that is not in Edit Mode (Armature.bones), in armature space"""
+        return finish(cls.read_steps(bones, ends=REST_ENDS))
+
+    @classmethod
+    def from_edit_bones_like(cls, edit_bones, like):
+        """Reads only the heads, tails and connect flags, taking the names and parents from like.
+
+        like is a snapshot of the same bones, its topology is shared too, so
+        no bone is visited in Python. Renamed or re-parented bones are not
+        seen, topology_matches checks a few of them.
+        """
+        with PROFILER.phase("read"):
+            heads, tails, connect = read_ends(edit_bones, len(like))
+            snapshot = cls(like.names, heads, tails, like.parents, connect, like.index)
+            for name in ("hierarchy", "topology_key"):
+                if name in like.__dict__:
+                    snapshot.__dict__[name] = like.__dict__[name]
+        PROFILER.count("bones_read", len(like))
+        return snapshot
+
+    @classmethod
+    def read_steps(cls, edit_bones, ends=EDIT_ENDS):
+        """from_edit_bones as a step generator.
+
+        Blender may free the edit bones between two timer events (undo
+        rebuilds them), so all of them are read before the first step and
+        none is held across it.
+        """
+        with PROFILER.phase("read"):
+            count = len(edit_bones)
+            heads, tails, connect = read_ends(edit_bones, count, ends)
+            names = []
+            parent_names = []
+            for bone in edit_bones:
+                names.append(bone.name)
+                parent_names.append(bone.parent.name if bone.parent else None)
+            index = {name: i for i, name in enumerate(names)}
+            parents = np.fromiter(
+                (-1 if name is None else index[name] for name in parent_names),
+                dtype=np.int32,
+                count=count,
+            )
+        PROFILER.count("bones_read", count)
+        yield 1.0
+        return cls(names, heads, tails, parents, connect)
+
+    @classmethod
+    def from_records(cls, records):
+        records = list(records)
+        names = [record.name for record in records]
+        index = {name: i for i, name in enumerate(names)}
+        parents = np.array(
+            [-1 if record.parent is None else index[record.parent] for record in records],
+            dtype=np.int32,
+        )
+        heads = np.array([record.head for record in records], dtype=np.float32).reshape(-1, 3)
+        tails = np.array([record.tail for record in records], dtype=np.float32).reshape(-1, 3)
+        connect = np.array([record.use_connect for record in records], dtype=bool)
+        return cls(names, heads, tails, parents, connect)
+
+    def records(self):
+        for bone, name in enumerate(self.names):
+            parent = self.parents[bone]
+            yield BoneRecord(
+                name,
+                self.names[parent] if parent >= 0 else None,
+                tuple(self.heads[bone].tolist()),
+                tuple(self.tails[bone].tolist()),
+                bool(self.connect[bone]),
+            )
+
+    def recipe(self, names=None):
+        """Returns a DeltaJournal of the current values of the named bones (all of them by default) to save as a recipe"""
+        bones = np.arange(len(self)) if names is None else np.sort(match_names(names, self.index))
+        return DeltaJournal.between(self, bones[bones >= 0])
+
+    def topology_matches(self, edit_bones, bones):
+        """Whether the given bones of the edit bones still have the names and parents of the snapshot"""
+        names = self.names
+        for bone in bones.tolist():
+            edit_bone = edit_bones[bone]
+            parent = int(self.parents[bone])
+            if edit_bone.name != names[bone]:
+                return False
+            if (edit_bone.parent.name if edit_bone.parent else None) != (names[parent] if parent >= 0 else None):
+                return False
+        return True
+
+    def matches(self, edit_bones):
+        """Whether the edit bones still hold the values last read from or written to them"""
+        if len(edit_bones) != len(self):
+            return False
+        for attribute, stored in zip(("head", "tail", "use_connect"), self.stored):
+            current = np.empty(stored.size, dtype=stored.dtype)
+            edit_bones.foreach_get(attribute, current)
+            if not np.array_equal(current, stored.ravel()):
+                return False
+        return True
+
+    def reparent(self, bones, parents):
+        """Gives the bones new parents, the topology derived from the old ones is dropped"""
+        self.parents = self.parents.copy()
+        self.parents[bones] = parents
+        self.__dict__.pop("hierarchy", None)
+        self.__dict__.pop("chains", None)
+        self.__dict__.pop("topology_key", None)
+        self.__dict__.pop("mirror", None)
+
+    def write_parents(self, edit_bones, bones):
+        """Sets the parent of the given edit bones to their parent in the snapshot.
+
+        Blender silently refuses a parent that is below the bone, which a new
+        parent can still be while the others are being set. So the parents
+        of all the bones are cleared first, then every new parent is set.
+        Clearing a parent also disconnects the bone, so the connect flags
+        stored in the snapshot are written back.
+        """
+        bones = np.asarray(bones).tolist()
+        if not bones:
+            return
+        for bone in bones:
+            edit_bones[self.names[bone]].parent = None
+        for bone in bones:
+            parent = self.parents[bone]
+            if parent >= 0:
+                edit_bones[self.names[bone]].parent = edit_bones[self.names[parent]]
+        edit_bones.foreach_set("use_connect", self.stored[2])
+
+    def changed_bones(self, tolerance=WRITE_TOLERANCE):
+        """Returns masks of the bones whose head, tail and connect flag differ from the edit bones"""
+        stored_heads, stored_tails, stored_connect = self.stored
+        return (
+            np.any(np.abs(self.heads - stored_heads) > tolerance, axis=1),
+            np.any(np.abs(self.tails - stored_tails) > tolerance, axis=1),
+            self.connect != stored_connect,
+        )
+
+    def write_edit_bones(self, edit_bones, tolerance=WRITE_TOLERANCE, force=False):
+        """Writes the values that changed back and returns a DeltaJournal of the modified bones.
+
+        Heads and tails that moved less than tolerance keep their old value.
+        An attribute is only written when some bone changed it, and nothing is
+        written when no bone changed, so the armature is not touched at all.
+        """
+        with PROFILER.phase("write"):
+            heads_changed, tails_changed, connect_changed = self.settle_changes(tolerance)
+            if force or heads_changed.any():
+                edit_bones.foreach_set("head", self.heads.ravel())
+            if force or tails_changed.any():
+                edit_bones.foreach_set("tail", self.tails.ravel())
+            if force or connect_changed.any():
+                edit_bones.foreach_set("use_connect", self.connect)
+
+            modified = np.flatnonzero(heads_changed | tails_changed | connect_changed)
+            journal = DeltaJournal.between(self, modified)
+            self.stored = (self.heads, self.tails, self.connect)
+        PROFILER.count("bones_written", len(journal))
+        return journal
+
+    def pending_journal(self, tolerance=WRITE_TOLERANCE):
+        """Returns the DeltaJournal write_edit_bones would return, without writing anything.
+
+        The journal is not applied, so it holds the bones that would change.
+        """
+        with PROFILER.phase("write"):
+            heads_changed, tails_changed, connect_changed = self.settle_changes(tolerance)
+            journal = DeltaJournal.between(self, np.flatnonzero(heads_changed | tails_changed | connect_changed))
+            journal.applied = False
+        PROFILER.count("bones_pending", len(journal))
+        return journal
+
+    def settle_changes(self, tolerance):
+        """Puts back the stored heads and tails that moved less than tolerance and returns changed_bones"""
+        heads_changed, tails_changed, connect_changed = self.changed_bones(tolerance)
+        stored_heads, stored_tails, _ = self.stored
+        self.heads = np.where(heads_changed[:, None], self.heads, stored_heads)
+        self.tails = np.where(tails_changed[:, None], self.tails, stored_tails)
+        return heads_changed, tails_changed, connect_changed
+
+def read_ends(edit_bones, count, ends=EDIT_ENDS):
+    """Reads the (heads, tails, connect) arrays of the bones with foreach_get"""
+    heads = np.empty(count * 3, dtype=np.float32)
+    tails = np.empty(count * 3, dtype=np.float32)
+    connect = np.empty(count, dtype=bool)
+    edit_bones.foreach_get(ends[0], heads)
+    edit_bones.foreach_get(ends[1], tails)
+    edit_bones.foreach_get("use_connect", connect)
+    return heads.reshape(count, 3), tails.reshape(count, 3), connect
+
+def match_names(names, index):
+    """Returns the index of every name in the name to index dict, -1 for the names it does not have"""
+    return np.fromiter((index.get(name, -1) for name in names), dtype=np.intp, count=len(names))
+
+class DeltaJournal:
+    """The bones an adjustment modified, with their values before and after it.
+
+    Only the modified bones are kept, in small parallel arrays, so a journal
+    can revert, redo or toggle an adjustment and replay it on another copy of
+    the rig (matched by bone name) without a copy of the whole armature.
+    """
+
+    def __init__(self, names, before, after):
+        self.names = names
+        # (heads, tails, connect) arrays, one row per name
+        self.before = before
+        self.after = after
+        self.applied = True
+        # Names of the bones guard_bones caught, and of the adjusted bones
+        # without a mirror bone in a mirrored adjustment
+        self.guarded = []
+        self.unpaired = []
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def between(cls, snapshot, bones):
+        """Journals bones from the values stored in the edit bones to the ones in the snapshot"""
+        heads, tails, connect = snapshot.stored
+        return cls(
+            [snapshot.names[bone] for bone in bones.tolist()],
+            (heads[bones], tails[bones], connect[bones]),
+            (snapshot.heads[bones], snapshot.tails[bones], snapshot.connect[bones]),
+        )
+
+    def apply(self, snapshot, after=True):
+        """Sets the journaled bones of the snapshot to their values after (or before) the adjustment.
+
+        Returns the names of the journaled bones the snapshot does not have.
+        """
+        heads, tails, connect = self.after if after else self.before
+        bones = match_names(self.names, snapshot.index)
+        found = bones >= 0
+        bones = bones[found]
+
+        snapshot.heads = snapshot.heads.copy()
+        snapshot.tails = snapshot.tails.copy()
+        snapshot.connect = snapshot.connect.copy()
+        snapshot.heads[bones] = heads[found]
+        snapshot.tails[bones] = tails[found]
+        snapshot.connect[bones] = connect[found]
+        self.applied = after
+        return [name for name, matched in zip(self.names, found.tolist()) if not matched]
+
+    def save(self, path):
+        """Writes the journal to a compressed .npz recipe, the names are its keys"""
+        np.savez_compressed(
+            path,
+            format=RECIPE_FORMAT,
+            names=np.array(self.names, dtype=str),
+            before_heads=self.before[0],
+            before_tails=self.before[1],
+            before_connect=self.before[2],
+            after_heads=self.after[0],
+            after_tails=self.after[1],
+            after_connect=self.after[2],
+        )
+
+    @classmethod
+    def load(cls, path):
+        """Reads a recipe written by save"""
+        with np.load(path, allow_pickle=False) as recipe:
+            if "format" not in recipe or int(recipe["format"]) != RECIPE_FORMAT:
+                raise ValueError("%s is not a bone tool recipe." % path)
+            return cls(
+                recipe["names"].tolist(),
+                (recipe["before_heads"], recipe["before_tails"], recipe["before_connect"]),
+                (recipe["after_heads"], recipe["after_tails"], recipe["after_connect"]),
+            )
+
+    def records(self, chunk_size=STEP_SIZE, **fields):
+        """Yields a dict per journaled bone with its values before and after and how far its ends move.
+
+        fields (like the armature name) are added to every record. The
+        records are built a chunk of bones at a time.
+        """
+        for start in range(0, len(self), chunk_size):
+            chunk = slice(start, start + chunk_size)
+            old_heads, old_tails, old_connect = (values[chunk] for values in self.before)
+            new_heads, new_tails, new_connect = (values[chunk] for values in self.after)
+            head_moves = np.linalg.norm(new_heads - old_heads, axis=1).tolist()
+            tail_moves = np.linalg.norm(new_tails - old_tails, axis=1).tolist()
+            values = zip(
+                self.names[chunk],
+                old_heads.tolist(), new_heads.tolist(), head_moves,
+                old_tails.tolist(), new_tails.tolist(), tail_moves,
+                old_connect.tolist(), new_connect.tolist(),
+            )
+            for name, old_head, new_head, head_move, old_tail, new_tail, tail_move, was_connected, connected in values:
+                yield dict(
+                    fields,
+                    bone=name,
+                    old_head=old_head,
+                    new_head=new_head,
+                    head_displacement=head_move,
+                    old_tail=old_tail,
+                    new_tail=new_tail,
+                    tail_displacement=tail_move,
+                    old_connect=was_connected,
+                    new_connect=connected,
+                )
+
+    def write(self, edit_bones, after=True):
+        """Like apply, but on the edit bones themselves"""
+        snapshot = SkeletonSnapshot.from_edit_bones(edit_bones)
+        missing = self.apply(snapshot, after)
+        snapshot.write_edit_bones(edit_bones)
+        return missing
+
+class RecordWriter:
+    """Writes records to a text stream one at a time, as NDJSON lines or as a JSON array"""
+
+    def __init__(self, stream, as_array=False):
+        self.stream = stream
+        self.as_array = as_array
+        self.count = 0
+
+    def write(self, record):
+        line = json.dumps(record)
+        if self.as_array:
+            self.stream.write(("[\n" if self.count == 0 else ",\n") + line)
+        else:
+            self.stream.write(line + "\n")
+        self.count += 1
+
+    def close(self):
+        if self.as_array:
+            self.stream.write("\n]\n" if self.count else "[]\n")
+        self.stream.flush()
+
+class AdjustmentPlan:
+    """A traversal and an adjustment mode compiled to index arrays.
+
+    Slots [0, n) are the heads and [n, 2n) the tails of the n bones. Every
+    operation copies read_slots[i] into target_slots[i], where read slots of
+    [2n, 4n) mean the value the slot had before the adjustment.
+    """
+
+    def __init__(self, count, target_slots, read_slots, targets, released, target_end=0):
+        self.count = count
+        # The end (0 = head, 1 = tail) the plan sets
+        self.target_end = target_end
+        self.target_slots = target_slots
+        self.read_slots = read_slots
+        self.targets = targets
+        # Bones that stop following their parent's tail before it moves
+        self.released = released
+
+    def __len__(self):
+        return len(self.targets)
+
+    def subset(self, keep):
+        """Returns the plan with only the operations of the kept targets (a mask or indices)"""
+        # released is either all the targets or none of them
+        released = self.released[keep] if len(self.released) else self.released
+        return AdjustmentPlan(
+            self.count, self.target_slots[keep], self.read_slots[keep], self.targets[keep], released, self.target_end
+        )
+
+    def operations_on(self, bones):
+        """Returns the indices of the operations targeting the given bones"""
+        # Which operation targets every bone is kept with the plan like its splits
+        operation_of = self.__dict__.get("operation_of")
+        if operation_of is None:
+            operation_of = self.__dict__["operation_of"] = np.full(self.count, -1, dtype=np.intp)
+            operation_of[self.targets] = np.arange(len(self.targets))
+        operations = operation_of[bones]
+        return operations[operations >= 0]
+
+    def split(self, groups):
+        """Returns the (operations, plan) of every SubtreeGroups group, None when the plan copies between groups.
+
+        The plans are in the bone positions of their group, operations are
+        the indices of their operations in this plan. The split is kept with
+        the plan, which is cached for its topology like the groups.
+        """
+        splits = self.__dict__.setdefault("splits", {})
+        key = len(groups)
+        if key not in splits:
+            splits[key] = self.split_into(groups)
+        return splits[key]
+
+    def split_into(self, groups):
+        count = self.count
+        group_of = groups.group_of
+        positions = groups.positions
+        if np.any(group_of[self.read_slots % count] != group_of[self.targets]):
+            return None
+
+        operations = np.argsort(group_of[self.targets], kind="stable")
+        operation_bounds = np.searchsorted(group_of[self.targets][operations], np.arange(len(groups) + 1))
+        released = np.sort(positions[self.released])
+        released_bounds = np.searchsorted(released, groups.bounds)
+        parts = []
+        for group in range(len(groups)):
+            start, end = groups.bounds[group], groups.bounds[group + 1]
+            size = end - start
+            ops = operations[operation_bounds[group]:operation_bounds[group + 1]]
+            target_slots = self.target_slots[ops]
+            read_slots = self.read_slots[ops]
+            parts.append((ops, AdjustmentPlan(
+                size,
+                target_slots // count * size + positions[target_slots % count] - start,
+                read_slots // count * size + positions[read_slots % count] - start,
+                positions[self.targets[ops]] - start,
+                released[released_bounds[group]:released_bounds[group + 1]] - start,
+                self.target_end,
+            )))
+        return parts
+
+    @classmethod
+    def compile(cls, count, sources, targets, mode, leaf_first=False):
+        """Compiles the (source, target) pairs for mode.
+
+        A source is read after its own adjustment, so chains propagate like the
+        recursive walk always did. With leaf_first the children are adjusted
+        before their parents, so every source is read as it was.
+        """
+        sources = np.asarray(sources, dtype=np.intp)
+        targets = np.asarray(targets, dtype=np.intp)
+        target_end, source_end = ADJUSTMENT_ENDS[mode]
+
+        read_slots = sources + source_end * count
+        if leaf_first:
+            read_slots += 2 * count
+
+        # A bone that was connected follows its parent's tail until it is
+        # adjusted itself: when its head is set, or before its parent with leaf_first
+        released = targets if target_end == 0 or leaf_first else targets[:0]
+        return cls(count, targets + target_end * count, read_slots, targets, released, target_end)
+
+class PlanCache:
+    """Least recently used AdjustmentPlans (and BoneChains), keyed by topology and settings.
+
+    Keys are (topology_key, kind, ...) tuples. Every kind keeps its own size
+    entries, so the chains of one armature do not push out the plan of
+    another, and fit grows size to the armatures of an edit session.
+    """
+
+    def __init__(self, size=32):
+        self.size = size
+        self.kinds = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, build):
+        plan = self.lookup(key)
+        if plan is None:
+            plan = self.store(key, build())
+        return plan
+
+    def lookup(self, key):
+        plans = self.kinds.get(key[1])
+        plan = None if plans is None else plans.get(key)
+        if plan is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            plans.move_to_end(key)
+        return plan
+
+    def store(self, key, plan):
+        plans = self.kinds.setdefault(key[1], OrderedDict())
+        plans[key] = plan
+        if len(plans) > self.size:
+            plans.popitem(last=False)
+        return plan
+
+    def fit(self, armatures):
+        """Makes room for an entry of every kind for each of the given number of armatures"""
+        self.size = max(self.size, armatures)
+
+    def clear(self):
+        self.kinds.clear()
+
+PLAN_CACHE = PlanCache()
+
+def apply_plan(snapshot, plan, reconnect, bones=None):
+    """Applies a compiled plan to every bone of the snapshot at once.
+
+    Connected bones keep their head on the tail of their parent like Blender
+    does when that tail moves, see "Connected bones" in the README for the
+    connected bones whose head is set. reconnect is a flag for all targets or an
+    array with one flag per target. Large forests are split by root subtree
+    and computed on WORKERS threads. With bones, a set of bones holding all
+    their descendants, only the operations on them are applied and only
+    those bones are computed.
+    """
+    if bones is not None:
+        return apply_plan_below(snapshot, plan, reconnect, bones)
+    PROFILER.count("pairs", len(plan))
+    with PROFILER.phase("adjust"):
+        count = len(snapshot)
+        if count == 0:
+            return
+        if WORKERS > 1 and count >= PARALLEL_MIN_BONES and len(snapshot.hierarchy.roots) > 1:
+            if apply_plan_by_subtree(snapshot, plan, reconnect, snapshot.subtree_groups(WORKERS)):
+                return
+        snapshot.heads, snapshot.tails, snapshot.connect = adjust_arrays(
+            snapshot.heads,
+            snapshot.tails,
+            snapshot.parents,
+            snapshot.connect,
+            plan.target_slots,
+            plan.read_slots,
+            plan.targets,
+            plan.released,
+            reconnect,
+        )
+
+def adjust_arrays(heads, tails, parents, connect, target_slots, read_slots, targets, released, reconnect):
+    """apply_plan on plain arrays, returns the adjusted heads, tails and connect flags"""
+    count = len(heads)
+
+    # Slots [0, 2n) are the adjusted heads and tails, slots [2n, 4n) the
+    # original ones. Every adjusted slot links to the slot it copies from.
+    slots = np.arange(4 * count)
+    link = slots.copy()
+    link[:2 * count] += 2 * count
+    link[target_slots] = read_slots
+
+    # A connected bone that stays connected while its head is set from
+    # another bone than its parent drags its parent's tail along, like
+    # setting EditBone.head does
+    reconnect = np.broadcast_to(reconnect, len(targets))
+    target_parents = parents[targets]
+    dragging = (
+        (target_slots < count) & reconnect & connect[targets]
+        & (target_parents >= 0) & (read_slots % count != target_parents)
+    )
+    link[target_parents[dragging] + count] = read_slots[dragging]
+
+    following = connect.copy()
+    following[released] = False
+    connect = connect.copy()
+    connect[targets] = reconnect
+    following |= connect
+    following = np.flatnonzero(following & (parents >= 0))
+    link[following] = parents[following] + count
+
+    # Pointer jumping resolves every chain of copies in O(log n) passes
+    for _ in range((4 * count).bit_length() + 1):
+        jumped = link[link]
+        if np.array_equal(jumped, link):
+            break
+        link = jumped
+
+    # Two bones can only copy from each other through a connection, such a cycle
+    # keeps the values the bones had before
+    cyclic = link[link] != link
+    link[cyclic] = slots[cyclic] + 2 * count
+
+    original = np.concatenate((heads, tails))
+    adjusted = original[link[:2 * count] - 2 * count]
+    return adjusted[:count], adjusted[count:], connect
+
+def apply_plan_below(snapshot, plan, reconnect, bones):
+    """apply_plan on the given bones, computed on them and the parents they read from.
+
+    The bones outside are not adjusted, so for the result to match the whole
+    plan they must already be where the plan puts them.
+    """
+    operations = plan.operations_on(bones)
+    PROFILER.count("pairs", len(operations))
+    with PROFILER.phase("adjust"):
+        count = len(snapshot)
+        parents = snapshot.parents[bones]
+        local = np.full(count, -1, dtype=np.intp)
+        local[bones] = np.arange(len(bones))
+        # The parents outside are read, but stay as they are
+        outside = np.unique(parents[(parents >= 0) & (local[parents] < 0)])
+        local[outside] = np.arange(len(bones), len(bones) + len(outside))
+        computed = np.concatenate((bones, outside))
+        size = len(computed)
+        local_parents = np.full(size, -1, dtype=np.intp)
+        local_parents[:len(bones)] = np.where(parents >= 0, local[parents], -1)
+
+        def local_slots(slots):
+            return slots // count * size + local[slots % count]
+
+        targets = local[plan.targets[operations]]
+        heads, tails, connect = adjust_arrays(
+            snapshot.heads[computed],
+            snapshot.tails[computed],
+            local_parents,
+            snapshot.connect[computed],
+            local_slots(plan.target_slots[operations]),
+            local_slots(plan.read_slots[operations]),
+            targets,
+            # released is either all the targets or none of them
+            targets if len(plan.released) else targets[:0],
+            reconnect if np.ndim(reconnect) == 0 else np.asarray(reconnect)[operations],
+        )
+        snapshot.heads = snapshot.heads.copy()
+        snapshot.tails = snapshot.tails.copy()
+        snapshot.connect = snapshot.connect.copy()
+        snapshot.heads[bones] = heads[:len(bones)]
+        snapshot.tails[bones] = tails[:len(bones)]
+        snapshot.connect[bones] = connect[:len(bones)]
+
+def apply_plan_by_subtree(snapshot, plan, reconnect, groups):
+    """apply_plan with every group of root subtrees computed on its own thread.
+
+    Every thread reads and writes its slice of arrays in group order, which
+    are the arrays of the snapshot themselves when the subtrees already come
+    one after the other. Otherwise the bones are put in group order once and
+    put back in one pass at the end. Returns False, without changing
+    anything, when the plan copies between groups, like Snap to Nearest
+    Joint can.
+    """
+    parts = plan.split(groups)
+    if parts is None:
+        return False
+
+    arrays = (snapshot.heads, snapshot.tails, snapshot.connect)
+    if groups.order is not None:
+        arrays = tuple(values[groups.order] for values in arrays)
+    heads, tails, connect = arrays
+    adjusted = tuple(np.empty_like(values) for values in arrays)
+    reconnect = np.broadcast_to(reconnect, len(plan))
+
+    def adjust_group(group):
+        operations, part = parts[group]
+        start, end = groups.bounds[group], groups.bounds[group + 1]
+        results = adjust_arrays(
+            heads[start:end],
+            tails[start:end],
+            groups.parents[start:end],
+            connect[start:end],
+            part.target_slots,
+            part.read_slots,
+            part.targets,
+            part.released,
+            reconnect[operations],
+        )
+        for values, result in zip(adjusted, results):
+            values[start:end] = result
+
+    list(compute_pool().map(adjust_group, range(len(groups))))
+    if groups.order is not None:
+        in_order = adjusted
+        adjusted = tuple(np.empty_like(values) for values in in_order)
+        for values, result in zip(adjusted, in_order):
+            values[groups.order] = result
+    snapshot.heads, snapshot.tails, snapshot.connect = adjusted
+    PROFILER.count("subtree_groups", len(groups))
+    return True
+
+COMPUTE_POOL = None
+
+def compute_pool():
+    """The thread pool of apply_plan_by_subtree, started on first use"""
+    global COMPUTE_POOL
+    if COMPUTE_POOL is None:
+        COMPUTE_POOL = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="n32bt")
+    return COMPUTE_POOL
+
+def guard_bones(snapshot, policy, target_end, min_length=MIN_BONE_LENGTH):
+    """Finds the bones an adjustment made shorter than min_length or turned around, and applies policy.
+
+    The snapshot is compared to the values stored in the edit bones, in one
+    array pass. "skip" puts the bones back as they were, "keep_length" keeps
+    the end the adjustment set (target_end) and moves the other one back to
+    the original length and direction, since the new direction of a
+    collapsed or flipped bone is lost. "report" leaves them alone. Connected bones still follow their parent's
+    tail and a guarded bone no longer on it is disconnected. Returns the
+    guarded bones.
+    """
+    with PROFILER.phase("guard"):
+        stored_heads, stored_tails, stored_connect = snapshot.stored
+        old = stored_tails - stored_heads
+        new = snapshot.tails - snapshot.heads
+        old_lengths = np.linalg.norm(old, axis=1)
+        new_lengths = np.linalg.norm(new, axis=1)
+        moved = np.any((snapshot.heads != stored_heads) | (snapshot.tails != stored_tails), axis=1)
+        flipped = np.einsum("ij,ij->i", old, new) < 0
+        # Bones that already were zero-length are left to the panel's warning
+        bad = np.flatnonzero(moved & (old_lengths >= min_length) & ((new_lengths < min_length) | flipped))
+        PROFILER.count("bones_guarded", len(bad))
+        if len(bad) == 0 or policy == "report":
+            return bad
+
+        heads = snapshot.heads.copy()
+        tails = snapshot.tails.copy()
+        connect = snapshot.connect.copy()
+        if policy == "skip":
+            heads[bad] = stored_heads[bad]
+            tails[bad] = stored_tails[bad]
+            connect[bad] = stored_connect[bad]
+        elif target_end == 0:
+            tails[bad] = heads[bad] + old[bad]
+        else:
+            heads[bad] = tails[bad] - old[bad]
+
+        parents = snapshot.parents
+        guarded = np.zeros(len(snapshot), dtype=bool)
+        guarded[bad] = True
+        connected = connect & (parents >= 0)
+        off_parent = np.any(heads[bad] != tails[parents[bad]], axis=1)
+        connect[bad[connected[bad] & off_parent]] = False
+        following = np.flatnonzero(connected & ~guarded)
+        heads[following] = tails[parents[following]]
+        snapshot.heads, snapshot.tails, snapshot.connect = heads, tails, connect
+    return bad
+
+def apply_adjustment(snapshot, sources, targets, mode, reconnect, leaf_first=False, mirror=False):
+    """Applies the adjustment to every (source, target) pair of the snapshot at once.
+
+    With mirror the targets are adjusted on one side and mirrored to the
+    other, the targets without a mirror bone are returned.
+    """
+    plan = AdjustmentPlan.compile(len(snapshot), sources, targets, mode, leaf_first)
+    if not mirror:
+        apply_plan(snapshot, plan, reconnect)
+        return plan.targets[:0]
+    plan = mirror_plan(snapshot, plan)
+    apply_plan(snapshot, plan, reconnect)
+    return mirror_adjustment(snapshot, plan.targets)
+
+def single_child_pairs(snapshot):
+    """Returns the (parent, child) pairs of every bone with exactly one direct child"""
+    children = snapshot.chains.linked_bones()
+    return snapshot.parents[children], children
+
+def best_aligned_pairs(snapshot):
+    """Returns the (parent, child) pairs of every branch point and the child that best continues its direction"""
+    parents = snapshot.parents
+    children = np.flatnonzero(parents >= 0)
+    children = children[snapshot.hierarchy.child_counts[parents[children]] > 1]
+    branches = parents[children]
+
+    directions = snapshot.tails - snapshot.heads
+    lengths = np.linalg.norm(directions, axis=1)
+    directions /= np.where(lengths > 0, lengths, 1.0)[:, None]
+    alignment = np.einsum("ij,ij->i", directions[branches], directions[children])
+
+    best = np.lexsort((-alignment, branches))
+    branches, firsts = np.unique(branches[best], return_index=True)
+    return branches, children[best[firsts]]
+
+def all_bones_plan(snapshot, mode, through_branches=False):
+    """Returns the "Apply to All Bones" plan, cached for the topology of the snapshot.
+
+    Only the bones with exactly one direct child are adjusted, and with
+    through_branches also the best aligned child of every branch point.
+    """
+    def build():
+        sources, targets = single_child_pairs(snapshot)
+        return AdjustmentPlan.compile(len(snapshot), sources, targets, mode)
+
+    if not through_branches:
+        return PLAN_CACHE.get((snapshot.topology_key, "all_bones", mode), build)
+
+    # The best aligned children depend on the positions, so this plan is not cached
+    sources, targets = single_child_pairs(snapshot)
+    branches, aligned = best_aligned_pairs(snapshot)
+    return AdjustmentPlan.compile(
+        len(snapshot),
+        np.concatenate((sources, branches)),
+        np.concatenate((targets, aligned)),
+        mode,
+    )
+
+def all_bones_plan_steps(snapshot, mode, through_branches=False):
+    """all_bones_plan as a step generator, it is vectorized so it takes a single step"""
+    yield 0.0
+    return all_bones_plan(snapshot, mode, through_branches)
+
+def descendants_plan(snapshot, root, mode, leaf_first=False):
+    """Returns the cached "Apply From Selected Bone" plan for root"""
+    return finish(descendants_plan_steps(snapshot, root, mode, leaf_first))
+
+def descendants_plan_steps(snapshot, root, mode, leaf_first=False, chunk_size=STEP_SIZE):
+    """descendants_plan as a step generator, yielding its progress after every chunk of pairs"""
+    key = (snapshot.topology_key, "descendants", root, mode, leaf_first)
+    plan = PLAN_CACHE.lookup(key)
+    if plan is None:
+        # The order of the pairs does not matter, leaf_first is handled by the plan
+        chains = []
+        gathered = step = 0
+        for chain in snapshot.chains.walk_below(root):
+            chains.append(chain)
+            gathered += len(chain)
+            if gathered >= step + chunk_size:
+                step = gathered
+                yield gathered / len(snapshot)
+
+        targets = np.concatenate(chains)
+        sources = snapshot.parents[targets]
+        plan = PLAN_CACHE.store(key, AdjustmentPlan.compile(len(snapshot), sources, targets, mode, leaf_first))
+    return plan
+
+def fan_out_plan(snapshot, source, targets, mode):
+    """Returns the plan adjusting every bone named in targets from the bone named source.
+
+    The source end is read once for all targets, targets that are the source
+    or not in the snapshot are left out.
+    """
+    targets = match_names(targets, snapshot.index)
+    source = snapshot.index[source]
+    targets = targets[(targets >= 0) & (targets != source)]
+    return AdjustmentPlan.compile(len(snapshot), np.full(len(targets), source), targets, mode)
+
+def adjustment_steps(edit_bones, plan_steps, reconnect, verify=False, dry_run=False, guard=DEFAULT_GUARD, mirror=False):
+    """Runs a whole adjustment as a step generator and returns its DeltaJournal.
+
+    plan_steps(snapshot) is the step generator of the plan. Progress from 0 to
+    1 is yielded after every bounded step, and the edit bones are only written
+    by the last one, so a generator dropped before it is done leaves the
+    armature untouched. With verify, ValueError is raised instead of writing
+    when the edit bones changed since they were read. With dry_run nothing is
+    written and the pending journal is returned. The bones collapsed or
+    flipped by the adjustment get the guard policy, their names are in the
+    guarded list of the journal. With mirror only one side is adjusted and
+    mirrored to the other, the adjusted bones without a mirror bone are in
+    the unpaired list of the journal.
+    """
+    snapshot = yield from progress_range(SkeletonSnapshot.read_steps(edit_bones), 0.0, 0.5)
+    plan = yield from progress_range(timed_steps(plan_steps(snapshot), "plan"), 0.5, 0.9)
+    if mirror:
+        plan = mirror_plan(snapshot, plan)
+    apply_plan(snapshot, plan, reconnect)
+    guarded = guard_bones(snapshot, guard, plan.target_end)
+    unpaired = mirror_adjustment(snapshot, plan.targets) if mirror else plan.targets[:0]
+    yield 0.95
+
+    if verify and not snapshot.matches(edit_bones):
+        raise ValueError("The armature changed while it was being adjusted.")
+    journal = snapshot.pending_journal() if dry_run else snapshot.write_edit_bones(edit_bones)
+    journal.guarded = [snapshot.names[bone] for bone in guarded.tolist()]
+    journal.unpaired = [snapshot.names[bone] for bone in unpaired.tolist()]
+    return journal
+
+def multi_adjustment_steps(jobs):
+    """Runs the adjustment steps of several armatures one after the other and returns their journals.
+
+    jobs holds (edit_bones, steps) pairs. If a step fails or the generator is
+    closed early, the armatures already written are reverted, so either all
+    of them are adjusted or none is.
+    """
+    journals = []
+    try:
+        for i, (edit_bones, steps) in enumerate(jobs):
+            journal = yield from progress_range(steps, i / len(jobs), (i + 1) / len(jobs))
+            journals.append(journal)
+    except BaseException:
+        for (edit_bones, _), journal in zip(jobs, journals):
+            if journal.applied:
+                journal.write(edit_bones, after=False)
+        raise
+    return journals
+
+def apply_all_bones(edit_bones, mode, reconnect, dry_run=False, guard=DEFAULT_GUARD, mirror=False):
+    """Runs "Apply to All Bones" on the edit bones and returns the DeltaJournal of the modified bones"""
+    steps = adjustment_steps(
+        edit_bones,
+        lambda snapshot: all_bones_plan_steps(snapshot, mode),
+        reconnect,
+        dry_run=dry_run,
+        guard=guard,
+        mirror=mirror,
+    )
+    return finish(steps)
+
+def moved_bones(snapshot, last, tolerance=WRITE_TOLERANCE):
+    """Returns the mask of the bones whose head, tail or connect flag differ from last, a snapshot of the same bones"""
+    moved = snapshot.connect != last.connect
+    for new, old in ((snapshot.heads, last.heads), (snapshot.tails, last.tails)):
+        # Or-ing the columns is several times faster than any(axis=1)
+        far = np.abs(new - old) > tolerance
+        moved |= far[:, 0] | far[:, 1] | far[:, 2]
+    return moved
+
+def moved_subtrees(snapshot, last, through_branches=False):
+    """Returns the bones moved since last, a snapshot of the same bones, with all their descendants, depth first.
+
+    With through_branches the subtrees of their parents are taken too, since
+    moving a bone can change which child of a branch point is the aligned one.
+    """
+    moved = np.flatnonzero(moved_bones(snapshot, last))
+    if through_branches:
+        parents = snapshot.parents[moved]
+        moved = np.union1d(moved, parents[parents >= 0])
+
+    bones, starts, ends = snapshot.chains.preorder
+    order = np.argsort(starts[moved])
+    starts = starts[moved][order]
+    ends = ends[moved][order]
+    # Subtrees inside an earlier one are already taken
+    outer = np.ones(len(starts), dtype=bool)
+    outer[1:] = starts[1:] >= np.maximum.accumulate(ends)[:-1]
+    starts = starts[outer]
+    lengths = ends[outer] - starts
+    return bones[np.arange(lengths.sum()) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)]
+
+def summarize(snapshot, plan, reconnect, guard=DEFAULT_GUARD, mirror=False):
+    """Returns the ArmatureSummary of the snapshot, with the bones plan would change as pending.
+
+    The plan is applied to the snapshot like adjustment_steps does, with the
+    guard policy and mirror, to find them. Nothing is written.
+    """
+    lengths = np.linalg.norm(snapshot.tails - snapshot.heads, axis=1)
+    chains = snapshot.chains
+    if mirror:
+        plan = mirror_plan(snapshot, plan)
+    apply_plan(snapshot, plan, reconnect)
+    collapsing = guard_bones(snapshot, guard, plan.target_end)
+    if mirror:
+        mirror_adjustment(snapshot, plan.targets)
+    journal = snapshot.pending_journal()
+
+    largest_move = 0.0
+    largest_bone = None
+    if len(journal):
+        moves = np.maximum(
+            np.linalg.norm(journal.after[0] - journal.before[0], axis=1),
+            np.linalg.norm(journal.after[1] - journal.before[1], axis=1),
+        )
+        largest = int(moves.argmax())
+        largest_move = float(moves[largest])
+        largest_bone = journal.names[largest]
+
+    return ArmatureSummary(
+        bones=len(snapshot),
+        roots=len(snapshot.hierarchy.roots),
+        chains=len(chains),
+        branch_points=len(chains.branch_points),
+        zero_length=int(np.count_nonzero(lengths < MIN_BONE_LENGTH)),
+        pending=len(journal),
+        largest_move=largest_move,
+        largest_bone=largest_bone,
+        collapsing=len(collapsing),
+    )
+
+def strip_name(name, prefixes=(), suffixes=()):
+    """Returns the name without the first of the prefixes it starts with and the first of the suffixes it ends with"""
+    for prefix in prefixes:
+        if prefix and name.startswith(prefix):
+            name = name[len(prefix):]
+            break
+    for suffix in suffixes:
+        if suffix and name.endswith(suffix):
+            name = name[:-len(suffix)]
+            break
+    return name
+
+def reference_pairs(snapshot, reference, prefixes=(), suffixes=()):
+    """Returns the (reference bone, bone) pairs of the bones whose names match once stripped.
+
+    The reference names are put in a dict once and every bone is looked up
+    in it once. The pairs are cached for the topologies of both armatures.
+    """
+    prefixes = tuple(prefixes)
+    suffixes = tuple(suffixes)
+
+    def build():
+        index = {}
+        for bone, name in enumerate(reference.names):
+            # The first bone wins when two names strip to the same one
+            index.setdefault(strip_name(name, prefixes, suffixes), bone)
+        sources = match_names([strip_name(name, prefixes, suffixes) for name in snapshot.names], index)
+        targets = np.flatnonzero(sources >= 0)
+        return sources[targets], targets
+
+    key = (snapshot.topology_key, "reference", reference.topology_key, prefixes, suffixes)
+    return PLAN_CACHE.get(key, build)
+
+def align_to_reference(snapshot, reference, mode, reconnect, prefixes=(), suffixes=()):
+    """Moves the target end of every bone onto the source end of its bone in the reference snapshot.
+
+    Both snapshots are in the space of their own armature. Connected bones
+    keep their head on the tail of their parent like apply_plan. Returns the
+    bones without a match in the reference.
+    """
+    with PROFILER.phase("plan"):
+        sources, targets = reference_pairs(snapshot, reference, prefixes, suffixes)
+    PROFILER.count("pairs", len(targets))
+    target_end, source_end = ADJUSTMENT_ENDS[mode]
+
+    with PROFILER.phase("adjust"):
+        ends = [snapshot.heads.copy(), snapshot.tails.copy()]
+        ends[target_end][targets] = (reference.heads, reference.tails)[source_end][sources]
+
+        following = snapshot.connect.copy()
+        if target_end == 0:
+            following[targets] = False
+        snapshot.connect = snapshot.connect.copy()
+        snapshot.connect[targets] = reconnect
+        following |= snapshot.connect
+        # Tails never follow anything, so one pass puts every connected head on its parent's tail
+        following = np.flatnonzero(following & (snapshot.parents >= 0))
+        ends[0][following] = ends[1][snapshot.parents[following]]
+        snapshot.heads, snapshot.tails = ends
+
+    unmatched = np.ones(len(snapshot), dtype=bool)
+    unmatched[targets] = False
+    return np.flatnonzero(unmatched)
+
+def apply_recipe(edit_bones, recipe, dry_run=False, guard=DEFAULT_GUARD):
+    """Sets the bones of a recipe to their values in it, matched by name.
+
+    The bones the recipe collapses or flips get the guard policy, keeping
+    their heads. Returns the journal of the modified bones, with the guarded
+    ones in its guarded list, and the names of the recipe the edit bones do
+    not have.
+    """
+    snapshot = SkeletonSnapshot.from_edit_bones(edit_bones)
+    missing = recipe.apply(snapshot)
+    guarded = guard_bones(snapshot, guard, 0)
+    journal = snapshot.pending_journal() if dry_run else snapshot.write_edit_bones(edit_bones)
+    journal.guarded = [snapshot.names[bone] for bone in guarded.tolist()]
+    return journal, missing
+
+def nearest_points(points, queries, tolerance, exclude=None):
+    """Returns the nearest point within tolerance of every query, -1 where there is none.
+
+    The points are put in a PointTree, so a query only measures the points
+    of the leaves near it instead of all of them. Coincident points, like
+    the joints of a broken import piled up at the origin, are kept twice (a
+    query may exclude one of them). exclude holds a point index per query
+    that it may not match.
+    """
+    nearest = np.full(len(queries), -1, dtype=np.intp)
+    if len(points) == 0 or len(queries) == 0:
+        return nearest
+
+    _, positions = np.unique(points, axis=0, return_inverse=True)
+    candidates = first_in_groups(positions.ravel(), 2)
+    if exclude is not None:
+        tree_indices = np.full(len(points), -1, dtype=np.intp)
+        tree_indices[candidates] = np.arange(len(candidates))
+        exclude = tree_indices[exclude]
+    found = PointTree(points[candidates]).nearest(queries, tolerance, exclude)
+    nearest[found >= 0] = candidates[found[found >= 0]]
+    return nearest
+
+class PointTree:
+    """A balanced k-d tree of points, built with one sort per level and searched for all queries at once.
+
+    Node 1 is the root and the children of node n are 2n and 2n + 1. Node n
+    holds the points order[starts[n]:ends[n]], split in half along its
+    widest axis, inside the box from low[n] to high[n]. The nodes of the
+    last level are the leaves, of at most TREE_LEAF_SIZE points.
+    """
+
+    def __init__(self, points):
+        count = len(points)
+        self.points = points
+        self.depth = depth = int(np.ceil(np.log2(max(count / TREE_LEAF_SIZE, 1))))
+        size = 2 << depth
+        self.starts = starts = np.zeros(size, dtype=np.intp)
+        self.ends = ends = np.zeros(size, dtype=np.intp)
+        ends[1] = count
+        order = np.arange(count)
+        # Every node has points, at least half a leaf for the last level
+        for level in range(depth):
+            nodes = np.arange(1 << level, 2 << level)
+            sizes = ends[nodes] - starts[nodes]
+            ordered = points[order]
+            widths = np.maximum.reduceat(ordered, starts[nodes]) - np.minimum.reduceat(ordered, starts[nodes])
+            node_of = np.repeat(np.arange(len(nodes)), sizes)
+            along = ordered[np.arange(count), np.argmax(widths, axis=1)[node_of]]
+            order = order[np.lexsort((along, node_of))]
+            middles = starts[nodes] + sizes // 2
+            starts[2 * nodes], ends[2 * nodes] = starts[nodes], middles
+            starts[2 * nodes + 1], ends[2 * nodes + 1] = middles, ends[nodes]
+        self.order = order
+
+        leaves = np.arange(1 << depth, 2 << depth)
+        ordered = points[order]
+        self.low = np.empty((size, 3), dtype=points.dtype)
+        self.high = np.empty((size, 3), dtype=points.dtype)
+        self.low[leaves] = np.minimum.reduceat(ordered, starts[leaves])
+        self.high[leaves] = np.maximum.reduceat(ordered, starts[leaves])
+        for level in reversed(range(depth)):
+            nodes = np.arange(1 << level, 2 << level)
+            self.low[nodes] = np.minimum(self.low[2 * nodes], self.low[2 * nodes + 1])
+            self.high[nodes] = np.maximum(self.high[2 * nodes], self.high[2 * nodes + 1])
+
+    def nearest(self, queries, radius, exclude=None):
+        """Returns the index of the nearest point within radius of every query, -1 where there is none.
+
+        Every query first walks down to the leaf it is closest to, whose
+        nearest point bounds the search. Then all queries walk down together,
+        only into the nodes whose box is within their bound.
+        """
+        count = len(queries)
+        nearest = np.full(count, -1, dtype=np.intp)
+        bounds = np.full(count, radius, dtype=np.float64)
+        everyone = np.arange(count)
+        nodes = np.ones(count, dtype=np.intp)
+        for _ in range(self.depth):
+            nodes = 2 * nodes
+            nodes += self.box_distances(queries, nodes + 1) < self.box_distances(queries, nodes)
+        self.measure(queries, everyone, nodes, exclude, nearest, bounds)
+
+        query_ids = everyone
+        nodes = np.ones(count, dtype=np.intp)
+        for level in range(self.depth + 1):
+            near = self.box_distances(queries[query_ids], nodes) <= bounds[query_ids] ** 2
+            query_ids, nodes = query_ids[near], nodes[near]
+            if level < self.depth:
+                query_ids = np.repeat(query_ids, 2)
+                nodes = (2 * nodes[:, None] + (0, 1)).ravel()
+        self.measure(queries, query_ids, nodes, exclude, nearest, bounds)
+        return nearest
+
+    def box_distances(self, queries, nodes):
+        """Returns the squared distances from the queries to the boxes of the nodes"""
+        gaps = np.maximum(np.maximum(self.low[nodes] - queries, queries - self.high[nodes]), 0.0)
+        return np.einsum("ij,ij->i", gaps, gaps)
+
+    def measure(self, queries, query_ids, leaves, exclude, nearest, bounds):
+        """Measures the points of every (query, leaf) pair, updating the nearest point and bound of the queries"""
+        sizes = self.ends[leaves] - self.starts[leaves]
+        pair_queries = np.repeat(query_ids, sizes)
+        firsts = np.repeat(np.cumsum(sizes) - sizes - self.starts[leaves], sizes)
+        found = self.order[np.arange(sizes.sum()) - firsts]
+        distances = np.linalg.norm(self.points[found] - queries[pair_queries], axis=1)
+        keep = distances <= bounds[pair_queries]
+        if exclude is not None:
+            keep &= found != exclude[pair_queries]
+        pair_queries, found, distances = pair_queries[keep], found[keep], distances[keep]
+
+        closest = np.lexsort((distances, pair_queries))
+        matched, firsts = np.unique(pair_queries[closest], return_index=True)
+        nearest[matched] = found[closest[firsts]]
+        bounds[matched] = distances[closest[firsts]]
+
+def first_in_groups(keys, limit):
+    """Returns the indices of the first limit keys of every group of equal keys, sorted by key"""
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1])))
+    sizes = np.diff(np.append(starts, len(keys)))
+    ranks = np.arange(len(keys)) - np.repeat(starts, sizes)
+    return order[ranks < limit]
+
+def flip_name(name):
+    """Returns the name of the bone on the other side, None for a name without a side"""
+    match = SIDE_SUFFIX.match(name)
+    if match:
+        return match.group(1) + FLIPPED_SIDES[match.group(2)] + match.group(3)
+    match = SIDE_PREFIX.match(name)
+    if match:
+        return FLIPPED_SIDES[match.group(1)] + match.group(2)
+    match = SIDE_WORD.search(name)
+    if match:
+        word = match.group()
+        flipped = "right" if word.lower() == "left" else "left"
+        if word.isupper():
+            flipped = flipped.upper()
+        elif word[0].isupper():
+            flipped = flipped.capitalize()
+        return name[:match.start()] + flipped + name[match.end():]
+    return None
+
+def mirror_index(snapshot, tolerance=MIRROR_TOLERANCE):
+    """Returns the mirror bone across X of every bone, the bone itself for center bones and -1 when it has none.
+
+    Bones are paired by their side names (cached for the topology), the
+    rest by position: two bones whose ends mirror each other within
+    tolerance, or a center bone with both ends on X = 0.
+    """
+    def build():
+        flipped = [flip_name(name) for name in snapshot.names]
+        pairs = match_names([name if name is not None else "" for name in flipped], snapshot.index)
+        pairs[[name is None for name in flipped]] = -1
+        return pairs
+
+    mirror = PLAN_CACHE.get((snapshot.topology_key, "mirror_names"), build).copy()
+    flip = np.array((-1.0, 1.0, 1.0), dtype=np.float32)
+    lone = np.flatnonzero(mirror < 0)
+    heads = snapshot.heads[lone]
+    tails = snapshot.tails[lone]
+
+    centered = (np.abs(heads[:, 0]) <= tolerance) & (np.abs(tails[:, 0]) <= tolerance)
+    mirror[lone[centered]] = lone[centered]
+    lone = lone[~centered]
+    heads = heads[~centered]
+    tails = tails[~centered]
+
+    nearest = nearest_points(heads, heads * flip, tolerance)
+    found = np.flatnonzero(nearest >= 0)
+    matched = nearest[found]
+    # Both ends have to mirror, and the two bones have to pick each other
+    ends_match = np.linalg.norm(tails[matched] - tails[found] * flip, axis=1) <= tolerance
+    mutual = nearest[matched] == found
+    found = found[ends_match & mutual]
+    mirror[lone[found]] = lone[nearest[found]]
+    return mirror
+
+def mirror_plan(snapshot, plan):
+    """Drops the targets whose mirror bone is a target too on the -X side, mirror_adjustment adjusts them"""
+    mirror = snapshot.mirror
+    targets = plan.targets
+    adjusted = np.zeros(len(snapshot), dtype=bool)
+    adjusted[targets] = True
+    pairs = mirror[targets]
+    middles = snapshot.heads[targets, 0] + snapshot.tails[targets, 0]
+    mirrored = (pairs >= 0) & (pairs != targets) & adjusted[np.maximum(pairs, 0)] & (middles < 0)
+    return plan.subset(~mirrored)
+
+def mirror_adjustment(snapshot, bones):
+    """Sets the mirror bones of the adjusted bones to their values mirrored across X.
+
+    Connected heads are put back on their parent's tail. Returns the bones
+    that have no mirror bone.
+    """
+    with PROFILER.phase("mirror"):
+        pairs = snapshot.mirror[bones]
+        paired = (pairs >= 0) & (pairs != bones)
+        sources = bones[paired]
+        targets = pairs[paired]
+        flip = np.array((-1.0, 1.0, 1.0), dtype=np.float32)
+
+        heads = snapshot.heads.copy()
+        tails = snapshot.tails.copy()
+        connect = snapshot.connect.copy()
+        heads[targets] = snapshot.heads[sources] * flip
+        tails[targets] = snapshot.tails[sources] * flip
+        connect[targets] = snapshot.connect[sources]
+
+        following = np.flatnonzero(connect & (snapshot.parents >= 0))
+        heads[following] = tails[snapshot.parents[following]]
+        snapshot.heads, snapshot.tails, snapshot.connect = heads, tails, connect
+    PROFILER.count("bones_mirrored", len(targets))
+    return bones[pairs < 0]
+
+def looping_bones(parents):
+    """Flags the bones that are their own ancestor"""
+    count = len(parents)
+    jump = np.append(np.where(parents >= 0, parents, count), count)
+    # After at least count steps every bone is on a loop or past a root
+    for _ in range((count + 1).bit_length()):
+        jump = jump[jump]
+    looping = np.zeros(count + 1, dtype=bool)
+    looping[jump] = True
+    return looping[:count]
+
+def nearest_joint_pairs(snapshot, mode, tolerance):
+    """Returns the (source, target) pairs joining the target end of every bone to the nearest source end.
+
+    The bone's own parent wins when its source end is within tolerance, and
+    a bone is never joined to itself or to a bone below it.
+    """
+    target_end, source_end = ADJUSTMENT_ENDS[mode]
+    ends = (snapshot.heads, snapshot.tails)
+    points = ends[source_end]
+    queries = ends[target_end]
+    bones = np.arange(len(snapshot))
+    sources = nearest_points(points, queries, tolerance, exclude=bones)
+
+    parents = snapshot.parents
+    children = np.flatnonzero(parents >= 0)
+    distances = np.linalg.norm(points[parents[children]] - queries[children], axis=1)
+    near_parent = children[distances <= tolerance]
+    sources[near_parent] = parents[near_parent]
+
+    targets = np.flatnonzero(sources >= 0)
+    sources = sources[targets]
+    # Drop the pairs that would make a bone its own ancestor
+    while True:
+        joined = parents.copy()
+        joined[targets] = sources
+        looping = looping_bones(joined)[targets]
+        if not looping.any():
+            return sources, targets
+        sources = sources[~looping]
+        targets = targets[~looping]
+
+def snap_to_nearest_joints(snapshot, mode, tolerance, reparent, reconnect):
+    """Moves the target end of every bone onto the nearest source end of another bone.
+
+    Every bone snaps to the joints as they were, in a single pass. With
+    reparent in "head_to_tail" mode, the bones become children of the bone
+    they snapped to and reconnect connects them to it. Returns the bones
+    that got a new parent, they still have to be written with write_parents.
+    """
+    with PROFILER.phase("plan"):
+        sources, targets = nearest_joint_pairs(snapshot, mode, tolerance)
+    target_end, source_end = ADJUSTMENT_ENDS[mode]
+    reparented = targets[:0]
+    if reparent and mode == "head_to_tail":
+        moved = snapshot.parents[targets] != sources
+        reparented = targets[moved]
+        snapshot.reparent(reparented, sources[moved])
+
+    connect = snapshot.connect[targets]
+    if target_end == 0:
+        # Only a head on the tail of its parent can stay (or become) connected
+        on_parent = (snapshot.parents[targets] == sources) & (source_end == 1)
+        connect = on_parent & (connect | reconnect)
+
+    plan = AdjustmentPlan.compile(len(snapshot), sources, targets, mode, leaf_first=True)
+    apply_plan(snapshot, plan, connect)
+    return reparented
+
+def timed_steps(steps, phase):
+    """Passes the steps of a step generator on, timing every step as phase"""
+    while True:
+        with PROFILER.phase(phase):
+            try:
+                progress = next(steps)
+            except StopIteration as stop:
+                return stop.value
+        yield progress
+
+def progress_range(steps, start, end):
+    """Passes the steps of a step generator on, mapping its progress to [start, end]"""
+    while True:
+        try:
+            progress = next(steps)
+        except StopIteration as stop:
+            return stop.value
+        yield start + (end - start) * progress
+
+def finish(steps):
+    """Runs a step generator to the end and returns its result"""
+    while True:
+        try:
+            next(steps)
+        except StopIteration as stop:
+            return stop.value
@@ -0,0 +1,618 @@
+"""Batch "Apply to All Bones" for many .blend/.fbx files.
+
+Run it with Blender in the background:
+
+    blender -b --python n32bt_batch.py -- rigs/*.fbx --mode head_to_tail --reconnect --jobs 8
+
+Every file is fixed in its own background Blender process, with up to
+--jobs processes running at once. The fixed files are written to
+--output-dir, in the folders they have below the common folder of the
+inputs, and a per-file summary is printed (and written to --summary
+as JSON when given).
+
+With --dry-run nothing is saved. Every bone that would change is streamed
+as one JSON record to --records (NDJSON, or a JSON array for a .json
+file), or to stdout with the summary moved to stderr:
+
+    blender -b --python n32bt_batch.py -- rigs/*.fbx --dry-run --records changes.ndjson
+
+With --recipe the bones are set to their values in a recipe saved by
+"Export Recipe", matched by name, instead of being adjusted:
+
+    blender -b --python n32bt_batch.py -- rigs/*.fbx --recipe fixed_rig.npz
+
+With --pipeline the files stream through --jobs long-lived Blender
+sessions instead, one file at a time per session: load, then snapshot,
+fix and validate every armature, then export. The session is emptied and
+its orphan data purged between files, and a session that grows over
+--max-memory MB is replaced by a fresh one, so hundreds of files run
+without Blender's startup per file and without memory growing:
+
+    blender -b --python n32bt_batch.py -- nightly/*.fbx --pipeline --max-memory 2048 --summary nightly.ndjson
+
+Results are printed, and written to --summary, as every file finishes.
+
+With --cache every fixed file is kept in a cache directory, keyed by the
+contents of the input, the add-on's source code and the settings. A file that
+has not changed since an earlier run with the same settings is copied
+from the cache without starting Blender. The least recently used entries
+go once the cache is over --cache-size MB, and --invalidate drops the
+entries of the given files:
+
+    blender -b --python n32bt_batch.py -- nightly/*.fbx --pipeline --cache ~/.cache/n32bt
+    blender -b --python n32bt_batch.py -- nightly/hero.fbx --cache ~/.cache/n32bt --invalidate
+"""
+
+import argparse
+import gc
+import glob
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bpy
+import n32bt
+from n32bt import core
+
+RESULT_PREFIX = "N32BT_RESULT "
+RECORD_PREFIX = "N32BT_RECORD "
+SUPPORTED_EXTENSIONS = (".blend", ".fbx")
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="blender -b --python n32bt_batch.py --",
+        description="Apply notester32's Bone Tool to every armature of many files",
+    )
+    parser.add_argument("files", nargs="+", help="Files or glob patterns (.blend, .fbx)")
+    parser.add_argument("--mode", choices=list(core.ADJUSTMENT_ENDS), default="head_to_tail")
+    parser.add_argument("--reconnect", action="store_true", help="Reconnect the adjusted bones")
+    parser.add_argument(
+        "--guard", choices=core.GUARD_POLICIES, default=core.DEFAULT_GUARD,
+        help="What to do with bones that would collapse or flip",
+    )
+    parser.add_argument("--mirror", action="store_true", help="Adjust one side of mirrored rigs and mirror it")
+    parser.add_argument("--output-dir", default="fixed", help="Where the fixed files are written")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Number of Blender processes")
+    parser.add_argument("--summary", help="Write the per-file summary to this JSON file (NDJSON for .ndjson)")
+    parser.add_argument("--pipeline", action="store_true", help="Stream the files through --jobs long-lived Blender sessions")
+    parser.add_argument(
+        "--max-memory", type=int, default=4096,
+        help="With --pipeline, replace a Blender session once it uses more than this many MB (0 for no limit)",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="Only report the bones that would change")
+    parser.add_argument("--records", default="-", help="Where --dry-run writes its records, - for stdout")
+    parser.add_argument("--recipe", help="Apply this recipe (.npz) instead of Apply to All Bones")
+    parser.add_argument("--profile", action="store_true", help="Add the time of every phase to the summary")
+    parser.add_argument("--cache", help="Keep the fixed files in this directory and reuse them for unchanged inputs")
+    parser.add_argument("--cache-size", type=int, default=4096, help="Size of --cache in MB before old entries go")
+    parser.add_argument("--invalidate", action="store_true", help="Drop the --cache entries of the files and exit")
+    parser.add_argument("--blender", default=bpy.app.binary_path or "blender", help="Blender executable")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--input-root", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+def expand_files(patterns):
+    files = []
+    for pattern in patterns:
+        matches = glob.glob(pattern, recursive=True) or [pattern]
+        files.extend(path for path in sorted(matches) if path.lower().endswith(SUPPORTED_EXTENSIONS))
+    return list(dict.fromkeys(files))
+
+def input_root(files):
+    """The deepest folder holding all the files"""
+    return os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in files])
+
+def output_path(path, output_dir, root=None):
+    """Where the fixed file of path goes: its place below root, its own folder by default, under output_dir"""
+    path = os.path.abspath(path)
+    return os.path.join(output_dir, os.path.relpath(path, root or os.path.dirname(path)))
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as stream:
+        for chunk in iter(lambda: stream.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class ResultCache:
+    """Fixed files and their results on disk, keyed by input contents, add-on source and settings.
+
+    An entry is the directory <input hash>/<settings hash> holding the fixed
+    file and result.json. The modification time of result.json is the last
+    time the entry was used, the oldest go first when the cache is too big.
+    """
+
+    def __init__(self, path, max_size, args):
+        self.path = path
+        self.max_size = max_size
+        settings = {
+            # Any change to the code that fixes the files makes new entries
+            "source": [file_hash(path) for path in (n32bt.__file__, core.__file__, __file__)],
+            "mode": args.mode,
+            "reconnect": args.reconnect,
+            "guard": args.guard,
+            "mirror": args.mirror,
+            "recipe": file_hash(args.recipe) if args.recipe else None,
+        }
+        self.settings = hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+    def entry(self, path):
+        return os.path.join(self.path, file_hash(path), self.settings)
+
+    def fetch(self, entry, path, output):
+        """Copies the cached fixed file of entry to output and returns its result, None when there is no entry"""
+        try:
+            with open(os.path.join(entry, "result.json")) as stream:
+                result = json.load(stream)
+            shutil.copyfile(os.path.join(entry, os.path.basename(result["output"])), output)
+        except (OSError, ValueError, KeyError):
+            return None
+        os.utime(os.path.join(entry, "result.json"))
+        result.update(file=path, output=output, cached=True)
+        return result
+
+    def store(self, entry, result):
+        """Keeps the fixed file and result of a successful run in entry"""
+        staging = "%s.%d.tmp" % (entry, threading.get_ident())
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        shutil.copyfile(result["output"], os.path.join(staging, os.path.basename(result["output"])))
+        with open(os.path.join(staging, "result.json"), "w") as stream:
+            json.dump(result, stream)
+        shutil.rmtree(entry, ignore_errors=True)
+        os.replace(staging, entry)
+
+    def invalidate(self, path):
+        """Drops every entry of the contents of path, whatever the settings. Returns whether there were any"""
+        entries = os.path.join(self.path, file_hash(path))
+        found = os.path.isdir(entries)
+        shutil.rmtree(entries, ignore_errors=True)
+        return found
+
+    def evict(self):
+        """Drops the least recently used entries until the cache fits in max_size. Returns how many went"""
+        entries = []
+        for inputs in os.scandir(self.path):
+            if not inputs.is_dir():
+                continue
+            for entry in os.scandir(inputs.path):
+                try:
+                    files = list(os.scandir(entry.path))
+                    used = os.stat(os.path.join(entry.path, "result.json")).st_mtime
+                except OSError:
+                    used = 0.0
+                    files = []
+                entries.append((used, sum(item.stat().st_size for item in files if item.is_file()), entry.path))
+        entries.sort()
+        size = sum(entry[1] for entry in entries)
+        evicted = 0
+        for _, entry_size, path in entries:
+            if size <= self.max_size:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            size -= entry_size
+            evicted += 1
+        for inputs in os.scandir(self.path):
+            if inputs.is_dir() and not os.listdir(inputs.path):
+                os.rmdir(inputs.path)
+        return evicted
+
+def load_file(path, reset=True):
+    """Opens a .blend, or imports an .fbx into an empty session (or the current one without reset)"""
+    if path.lower().endswith(".fbx"):
+        if reset:
+            bpy.ops.wm.read_factory_settings(use_empty=True)
+        bpy.ops.import_scene.fbx(filepath=path)
+    else:
+        bpy.ops.wm.open_mainfile(filepath=path, load_ui=False)
+
+def save_file(path):
+    if path.lower().endswith(".fbx"):
+        bpy.ops.export_scene.fbx(filepath=path, add_leaf_bones=False)
+    else:
+        bpy.ops.wm.save_as_mainfile(filepath=path, copy=True)
+
+def clear_session():
+    """Removes every object and purges the data left without users, so the next file starts from an empty session"""
+    for obj in list(bpy.data.objects):
+        bpy.data.objects.remove(obj)
+    bpy.data.orphans_purge(do_local_ids=True, do_linked_ids=True, do_recursive=True)
+    gc.collect()
+
+def resident_memory():
+    """The resident memory of this process in bytes, the peak where the current one cannot be read, 0 if neither can"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def fix_armatures(mode, reconnect, dry_run=False, path=None, recipe=None, guard=core.DEFAULT_GUARD, mirror=False):
+    """Runs "Apply to All Bones", or applies the recipe, on every armature of the open file.
+
+    With dry_run the armatures are left alone and the record of every bone
+    that would change is printed instead.
+    """
+    return core.finish(fix_steps(mode, reconnect, dry_run, path, recipe, guard, mirror))
+
+def fix_steps(mode, reconnect, dry_run=False, path=None, recipe=None, guard=core.DEFAULT_GUARD, mirror=False):
+    """fix_armatures as a generator of stages, yielding the name of every stage before it runs.
+
+    Every armature goes through "snapshot" (Edit Mode, which copies the
+    bones to edit bones), "fix" and "validate" (back to Object Mode, where
+    Blender deletes zero-length bones). ValueError is raised when bones were
+    lost. Returns the armature, bone, adjusted and guarded bone counts.
+    """
+    armatures = bones = adjusted = guarded = 0
+    fixed = set()
+    for obj in bpy.context.scene.objects:
+        if obj.type != 'ARMATURE' or obj.data in fixed:
+            continue
+        fixed.add(obj.data)
+
+        yield "snapshot"
+        bpy.context.view_layer.objects.active = obj
+        with core.PROFILER.phase("mode_switch"):
+            bpy.ops.object.mode_set(mode='EDIT')
+        armatures += 1
+        edit_bones = len(obj.data.edit_bones)
+        bones += edit_bones
+
+        yield "fix"
+        if recipe is None:
+            journal = core.apply_all_bones(obj.data.edit_bones, mode, reconnect, dry_run, guard, mirror)
+        else:
+            journal, _ = core.apply_recipe(obj.data.edit_bones, recipe, dry_run, guard)
+        adjusted += len(journal)
+        guarded += len(journal.guarded)
+        if dry_run:
+            for record in journal.records(file=path, armature=obj.data.name):
+                print(RECORD_PREFIX + json.dumps(record))
+
+        yield "validate"
+        with core.PROFILER.phase("mode_switch"):
+            bpy.ops.object.mode_set(mode='OBJECT')
+        lost = edit_bones - len(obj.data.bones)
+        if lost:
+            raise ValueError("%s lost %d zero-length bones leaving Edit Mode, try --guard skip" % (obj.data.name, lost))
+    return armatures, bones, adjusted, guarded
+
+def file_steps(result, args, reset=True):
+    """Runs the file of result through the pipeline as a generator of stages, filling in the result.
+
+    The name of every stage is yielded before it runs: "load", the stages
+    of fix_steps for every armature, then "export".
+    """
+    path = result["file"]
+    recipe = core.DeltaJournal.load(args.recipe) if args.recipe else None
+    yield "load"
+    with core.PROFILER.phase("load"):
+        load_file(path, reset)
+    counts = yield from fix_steps(args.mode, args.reconnect, args.dry_run, path, recipe, args.guard, args.mirror)
+    result["armatures"], result["bones"], result["adjusted"], result["guarded"] = counts
+    if result["output"]:
+        yield "export"
+        with core.PROFILER.phase("save"):
+            save_file(result["output"])
+
+def add_stage_time(stages, stage, started):
+    now = time.perf_counter()
+    if stage is not None:
+        stages[stage] = stages.get(stage, 0.0) + now - started
+    return now
+
+def run_stages(path, args, reset=True):
+    """Runs one file through file_steps, timing every stage, and returns its result"""
+    output = None if args.dry_run else output_path(path, args.output_dir, args.input_root)
+    result = {"file": path, "output": output, "status": "ok", "dry_run": args.dry_run}
+    stages = result["stages"] = {}
+    if args.profile:
+        core.PROFILER.start(path)
+    stage = None
+    started = time.perf_counter()
+    try:
+        for next_stage in file_steps(result, args, reset):
+            started = add_stage_time(stages, stage, started)
+            stage = next_stage
+    except Exception as error:
+        result["status"] = "error"
+        result["error"] = str(error)
+    add_stage_time(stages, stage, started)
+
+    result["load_time"] = stages.get("load", 0.0)
+    result["fix_time"] = sum(stages.get(stage, 0.0) for stage in ("snapshot", "fix", "validate"))
+    result["save_time"] = stages.get("export", 0.0)
+    if args.profile:
+        result["profile"] = core.PROFILER.stop()
+    return result
+
+def run_worker(args):
+    """Fixes the single file given on the command line and prints its result"""
+    result = run_stages(args.files[0], args)
+    print(RESULT_PREFIX + json.dumps(result), flush=True)
+
+def run_pipeline_worker(args):
+    """Runs the files named on stdin one at a time in this Blender session, printing every result when it is done.
+
+    The session is emptied before the first file, so the Cube, Camera and
+    Light of --factory-startup are not exported with it, and after every
+    file. Once it still holds more than --max-memory, the result is marked
+    recycled and the worker exits, the batch goes on in a fresh session.
+    """
+    limit = args.max_memory * 1024 * 1024
+    clear_session()
+    for line in sys.stdin:
+        path = line.rstrip("\n")
+        if not path:
+            continue
+        result = run_stages(path, args, reset=False)
+        clear_session()
+        result["memory"] = resident_memory()
+        result["recycled"] = bool(limit) and result["memory"] > limit
+        print(RESULT_PREFIX + json.dumps(result), flush=True)
+        if result["recycled"]:
+            break
+
+def worker_command(args, files):
+    command = [
+        args.blender, "-b", "--factory-startup", "--python-exit-code", "1",
+        "--python", os.path.abspath(__file__), "--",
+        "--worker", *files,
+        "--mode", args.mode,
+        "--guard", args.guard,
+        "--output-dir", args.output_dir,
+        "--input-root", args.input_root,
+    ]
+    if args.reconnect:
+        command.append("--reconnect")
+    if args.mirror:
+        command.append("--mirror")
+    if args.dry_run:
+        command.append("--dry-run")
+    if args.profile:
+        command.append("--profile")
+    if args.recipe:
+        command += ["--recipe", os.path.abspath(args.recipe)]
+    if args.pipeline:
+        command += ["--pipeline", "--max-memory", str(args.max_memory)]
+    return command
+
+def read_result(stream, write_record):
+    """Passes the dry run records in the output of a worker to write_record up to its next result.
+
+    Returns the result, None when the output ends first.
+    """
+    for line in stream:
+        if line.startswith(RECORD_PREFIX):
+            write_record(json.loads(line[len(RECORD_PREFIX):]))
+        elif line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    return None
+
+def run_file(path, args, write_record):
+    """Starts a background Blender process for one file and collects its result.
+
+    The dry run records of the process are passed to write_record as they come.
+    """
+    start = time.perf_counter()
+    with subprocess.Popen(
+        worker_command(args, [path]), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
+    ) as process:
+        result = read_result(process.stdout, write_record)
+        process.stdout.read()
+    if result is None:
+        result = {"file": path, "status": "error", "error": "Blender exited with code %d" % process.returncode}
+    result["wall_time"] = time.perf_counter() - start
+    return result
+
+def run_pipeline(files, args, write_record, report):
+    """Feeds the files to --jobs long-lived Blender sessions and reports every result as it comes.
+
+    A session that goes over --max-memory, or crashes, is replaced by a
+    fresh one for the next file.
+    """
+    pending = deque(files)
+
+    def feed_session():
+        process = None
+        try:
+            while pending:
+                try:
+                    path = pending.popleft()
+                except IndexError:
+                    break
+                if process is None:
+                    process = subprocess.Popen(
+                        worker_command(args, ["-"]),
+                        stdin=subprocess.PIPE,
+                        stdout=subprocess.PIPE,
+                        stderr=subprocess.DEVNULL,
+                        text=True,
+                    )
+
+                start = time.perf_counter()
+                try:
+                    process.stdin.write(path + "\n")
+                    process.stdin.flush()
+                    result = read_result(process.stdout, write_record)
+                except OSError:
+                    result = None
+                if result is None or result.get("recycled"):
+                    close_session(process)
+                    if result is None:
+                        result = {"file": path, "status": "error", "error": "Blender exited with code %d" % process.returncode}
+                    process = None
+                result["wall_time"] = time.perf_counter() - start
+                report(result)
+        finally:
+            if process is not None:
+                close_session(process)
+
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        for future in [pool.submit(feed_session) for _ in range(min(max(1, args.jobs), len(files)))]:
+            future.result()
+
+def close_session(process):
+    try:
+        process.stdin.close()
+    except OSError:
+        pass
+    process.stdout.read()
+    process.wait()
+
+def format_result(result):
+    if result["status"] != "ok":
+        return "FAILED  %s: %s" % (result["file"], result.get("error", ""))
+    if result.get("dry_run"):
+        return "DRY RUN %s: %d armatures, %d/%d bones would be adjusted, %.2fs" % (
+            result["file"],
+            result["armatures"],
+            result["adjusted"],
+            result["bones"],
+            result["wall_time"],
+        )
+    line = "OK      %s: %d armatures, %d/%d bones adjusted, %.2fs (load %.2fs, fix %.3fs, save %.2fs)" % (
+        result["file"],
+        result["armatures"],
+        result["adjusted"],
+        result["bones"],
+        result["wall_time"],
+        result["load_time"],
+        result["fix_time"],
+        result["save_time"],
+    )
+    if result.get("cached"):
+        line += ", cached"
+    if "memory" in result:
+        line += ", %d MB" % (result["memory"] // (1024 * 1024))
+    return line
+
+def run_batch(args):
+    files = expand_files(args.files)
+    if not files:
+        print("No .blend or .fbx files matched.")
+        return 1
+    # Dry runs print records instead of writing files, there is nothing to cache
+    cache = None
+    if args.cache and not args.dry_run:
+        os.makedirs(args.cache, exist_ok=True)
+        try:
+            cache = ResultCache(args.cache, args.cache_size * 1024 * 1024, args)
+        except OSError as error:
+            print("Could not read the recipe: %s" % error)
+            return 1
+    if args.invalidate:
+        if cache is None:
+            print("--invalidate needs --cache.")
+            return 1
+        dropped = failed = 0
+        for path in files:
+            try:
+                dropped += cache.invalidate(path)
+            except OSError as error:
+                failed += 1
+                print(format_result({"file": path, "status": "error", "error": str(error)}))
+        print("%d of %d files dropped from the cache." % (dropped, len(files)))
+        return 1 if failed else 0
+    # Files keep their folders below the common folder of the inputs, so a/rig.fbx and b/rig.fbx stay apart
+    args.input_root = input_root(files)
+    if not args.dry_run:
+        for directory in {os.path.dirname(output_path(path, args.output_dir, args.input_root)) for path in files}:
+            os.makedirs(directory, exist_ok=True)
+
+    # Records on stdout push the summary to stderr
+    records_to_stdout = args.dry_run and args.records == "-"
+    log = sys.stderr if records_to_stdout else sys.stdout
+    records = None
+    if args.dry_run:
+        stream = sys.stdout if records_to_stdout else open(args.records, "w")
+        records = core.RecordWriter(stream, as_array=args.records.lower().endswith(".json"))
+    summary = None
+    if args.summary:
+        summary = core.RecordWriter(open(args.summary, "w"), as_array=not args.summary.lower().endswith(".ndjson"))
+    lock = threading.Lock()
+    counts = {"ok": 0, "failed": 0}
+    entries = {}
+
+    def write_record(record):
+        with lock:
+            records.write(record)
+
+    def report(result):
+        # Results are written as they come, so none are kept in memory
+        with lock:
+            counts["ok" if result["status"] == "ok" else "failed"] += 1
+            entry = entries.pop(result["file"], None)
+            if entry and result["status"] == "ok":
+                cache.store(entry, result)
+            print(format_result(result), file=log, flush=True)
+            if summary:
+                summary.write(result)
+                summary.stream.flush()
+
+    try:
+        if cache:
+            misses = []
+            for path in files:
+                start = time.perf_counter()
+                # A file that cannot be read fails on its own, like it would in Blender
+                try:
+                    entry = cache.entry(path)
+                except OSError as error:
+                    report({"file": path, "status": "error", "error": str(error)})
+                    continue
+                result = cache.fetch(entry, path, output_path(path, args.output_dir, args.input_root))
+                if result is None:
+                    entries[path] = entry
+                    misses.append(path)
+                else:
+                    result["wall_time"] = time.perf_counter() - start
+                    report(result)
+            files = misses
+
+        if args.pipeline:
+            run_pipeline(files, args, write_record, report)
+        else:
+            with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+                futures = [pool.submit(run_file, path, args, write_record) for path in files]
+                for future in as_completed(futures):
+                    report(future.result())
+    finally:
+        for writer in (records, summary):
+            if writer:
+                writer.close()
+                if writer.stream is not sys.stdout:
+                    writer.stream.close()
+        if cache:
+            cache.evict()
+
+    print("%d files %s, %d failed." % (counts["ok"], "checked" if args.dry_run else "fixed", counts["failed"]), file=log)
+    return 1 if counts["failed"] else 0
+
+def main():
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    args = parse_args(argv)
+    if args.worker and args.pipeline:
+        run_pipeline_worker(args)
+    elif args.worker:
+        run_worker(args)
+    else:
+        sys.exit(run_batch(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+"""Benchmarks for notester32's Bone Tool on synthetic armatures.
+
+Run it with Blender in the background:
+
+    blender -b --factory-startup --python n32bt_bench.py -- --sizes 100 1000 10000 --output bench.json
+
+or with plain Python, where n32bt_fakebpy stands in for Blender:
+
+    python n32bt_bench.py -- --sizes 100 1000 10000 --output bench.json
+
+Every shape (long chains, wide fans, balanced trees, a humanoid with hair
+and a forest of small independent clumps) is built at every size, then
+every operator is run through n32bt.core.adjustment_steps, guard and
+mirror included, and timed phase by phase by the profiler. Pass --compare
+with an earlier result file to fail on slowdowns, and --workers to time
+the compute of large forests on a given number of threads.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    import bpy
+except ImportError:
+    import n32bt_fakebpy
+    bpy = n32bt_fakebpy.install()
+
+import numpy as np
+import n32bt
+from n32bt import core
+
+BONE_LENGTH = 0.1
+
+def build_positions(parents, directions, seed=0):
+    """Places every bone at the tail of its parent, then shifts the heads like a broken import"""
+    heads = np.zeros((len(parents), 3), dtype=np.float32)
+    tails = np.zeros((len(parents), 3), dtype=np.float32)
+    for bone, parent in enumerate(parents.tolist()):
+        if parent >= 0:
+            heads[bone] = tails[parent]
+        tails[bone] = heads[bone] + directions[bone]
+    heads += np.random.default_rng(seed).normal(0.0, BONE_LENGTH * 0.05, heads.shape).astype(np.float32)
+    return heads, tails
+
+def chain_shape(size):
+    parents = np.arange(-1, size - 1)
+    directions = np.tile((0.0, 0.0, BONE_LENGTH), (size, 1))
+    return parents, directions
+
+def fan_shape(size):
+    parents = np.zeros(size, dtype=np.intp)
+    parents[0] = -1
+    angles = np.linspace(0.0, 2.0 * np.pi, size, endpoint=False)
+    directions = np.stack((np.cos(angles), np.sin(angles), np.full(size, 0.5)), axis=1) * BONE_LENGTH
+    directions[0] = (0.0, 0.0, BONE_LENGTH)
+    return parents, directions
+
+def tree_shape(size):
+    parents = (np.arange(size) - 1) // 2
+    parents[0] = -1
+    sides = np.where(np.arange(size) % 2, 1.0, -1.0)
+    directions = np.stack((sides * 0.5, np.zeros(size), np.ones(size)), axis=1) * BONE_LENGTH
+    return parents, directions
+
+HUMANOID = [
+    # (parent, direction)
+    (-1, (0.0, 0.0, 1.0)),  # hips
+    (0, (0.0, 0.0, 1.0)),  # spine
+    (1, (0.0, 0.0, 1.0)),  # chest
+    (2, (0.0, 0.0, 0.5)),  # neck
+    (3, (0.0, 0.0, 1.0)),  # head
+    (2, (1.0, 0.0, 0.0)),  # shoulder.L
+    (5, (2.0, 0.0, 0.0)),  # upper_arm.L
+    (6, (2.0, 0.0, 0.0)),  # forearm.L
+    (7, (0.5, 0.0, 0.0)),  # hand.L
+    (2, (-1.0, 0.0, 0.0)),  # shoulder.R
+    (9, (-2.0, 0.0, 0.0)),  # upper_arm.R
+    (10, (-2.0, 0.0, 0.0)),  # forearm.R
+    (11, (-0.5, 0.0, 0.0)),  # hand.R
+    (0, (0.5, 0.0, -2.5)),  # thigh.L
+    (13, (0.0, 0.0, -2.5)),  # shin.L
+    (14, (0.0, -0.5, 0.0)),  # foot.L
+    (0, (-0.5, 0.0, -2.5)),  # thigh.R
+    (16, (0.0, 0.0, -2.5)),  # shin.R
+    (17, (0.0, -0.5, 0.0)),  # foot.R
+]
+HAND_BONES = (8, 12)
+HEAD_BONE = 4
+FINGER_LENGTH = 3
+HAIR_LENGTH = 12
+
+def humanoid_shape(size):
+    """A small humanoid with three bone fingers, then hair chains from the head up to size"""
+    parents = [parent for parent, _ in HUMANOID]
+    directions = [direction for _, direction in HUMANOID]
+    for hand in HAND_BONES:
+        side = directions[hand][0]
+        for finger in range(5):
+            parent = hand
+            for _ in range(FINGER_LENGTH):
+                parents.append(parent)
+                directions.append((side * 0.3, (finger - 2) * 0.05, 0.0))
+                parent = len(parents) - 1
+
+    rng = np.random.default_rng(1)
+    while len(parents) < size:
+        parent = HEAD_BONE
+        direction = rng.normal(0.0, 1.0, 3) * 0.2 + (0.0, 0.0, -0.3)
+        for _ in range(min(HAIR_LENGTH, size - len(parents))):
+            parents.append(parent)
+            directions.append(tuple(direction))
+            parent = len(parents) - 1
+
+    parents = np.array(parents[:size], dtype=np.intp)
+    directions = np.array(directions[:size], dtype=np.float32) * BONE_LENGTH
+    return parents, directions
+
+CLUMP_CHAINS = 3
+CLUMP_LENGTH = 4
+
+def forest_shape(size):
+    """Independent clumps of a root bone with a few short chains, like the props and hair of an import"""
+    clump_size = 1 + CLUMP_CHAINS * CLUMP_LENGTH
+    bones = np.arange(size)
+    clumps, places = np.divmod(bones, clump_size)
+    links = (places - 1) % CLUMP_LENGTH
+    parents = np.where(links == 0, clumps * clump_size, bones - 1)
+    parents[places == 0] = -1
+
+    chains = (places - 1) // CLUMP_LENGTH
+    angles = chains * (2.0 * np.pi / CLUMP_CHAINS) + clumps
+    directions = np.stack((np.cos(angles) * 0.5, np.sin(angles) * 0.5, np.full(size, -1.0)), axis=1)
+    directions[places == 0] = (0.0, 0.0, 1.0)
+    return parents, directions * BONE_LENGTH
+
+SHAPES = {
+    "chain": chain_shape,
+    "fan": fan_shape,
+    "tree": tree_shape,
+    "humanoid": humanoid_shape,
+    "forest": forest_shape,
+}
+
+def build_armature(name, parents, heads, tails):
+    data = bpy.data.armatures.new(name)
+    obj = bpy.data.objects.new(name, data)
+    bpy.context.scene.collection.objects.link(obj)
+    bpy.context.view_layer.objects.active = obj
+    bpy.ops.object.mode_set(mode='EDIT')
+
+    edit_bones = data.edit_bones
+    bones = [edit_bones.new("Bone.%05d" % i) for i in range(len(parents))]
+    for bone, parent in zip(bones, parents.tolist()):
+        if parent >= 0:
+            bone.parent = bones[parent]
+    edit_bones.foreach_set("head", heads.ravel())
+    edit_bones.foreach_set("tail", tails.ravel())
+    return obj
+
+def remove_armature(obj):
+    data = obj.data
+    bpy.ops.object.mode_set(mode='OBJECT')
+    bpy.data.objects.remove(obj)
+    bpy.data.armatures.remove(data)
+
+def pair_plan_steps(snapshot, mode):
+    """The plan of Apply Adjustment with the first bone as source and the last one as target"""
+    yield 0.0
+    return core.AdjustmentPlan.compile(len(snapshot), [0], [len(snapshot) - 1], mode)
+
+# The plan steps of every operator, as the operators build them
+OPERATORS = {
+    "armature.adjust_bones": pair_plan_steps,
+    "armature.apply_all_bones": core.all_bones_plan_steps,
+    "armature.apply_all_bones_from_bone": lambda snapshot, mode: core.descendants_plan_steps(snapshot, 0, mode),
+}
+
+def time_operator(name, edit_bones, plan_steps, args):
+    """Runs one operator's adjustment under the profiler and returns the seconds spent in each phase and in total"""
+    steps = core.adjustment_steps(
+        edit_bones,
+        lambda snapshot: plan_steps(snapshot, args.mode),
+        args.reconnect,
+        guard=args.guard,
+        mirror=args.mirror,
+    )
+    with core.PROFILER.run(name) as profiler:
+        core.finish(steps)
+    times = dict(profiler.last["phases"])
+    times["total"] = profiler.last["wall_time"]
+    return times
+
+def run_benchmarks(args):
+    results = []
+    for shape in args.shapes:
+        for size in args.sizes:
+            parents, directions = SHAPES[shape](size)
+            heads, tails = build_positions(parents, directions)
+            obj = build_armature("bench_%s_%d" % (shape, size), parents, heads, tails)
+            edit_bones = obj.data.edit_bones
+            original = core.SkeletonSnapshot.from_edit_bones(edit_bones)
+
+            for operator, plan_steps in OPERATORS.items():
+                runs = []
+                for _ in range(args.repeat):
+                    original.write_edit_bones(edit_bones, force=True)
+                    if not args.cached_plans:
+                        core.PLAN_CACHE.clear()
+                    runs.append(time_operator(operator, edit_bones, plan_steps, args))
+                for phase in runs[0]:
+                    phase_times = [run[phase] for run in runs]
+                    results.append({
+                        "shape": shape,
+                        "size": size,
+                        "operator": operator,
+                        "phase": phase,
+                        "best": min(phase_times),
+                        "median": statistics.median(phase_times),
+                    })
+                total = min(run["total"] for run in runs)
+                print("%-9s %6d  %-35s %.4fs" % (shape, size, operator, total), flush=True)
+
+            remove_armature(obj)
+    return results
+
+def find_regressions(results, baseline, tolerance):
+    """Returns the results slower than tolerance times their baseline"""
+    key = lambda result: (result["shape"], result["size"], result["operator"], result["phase"])
+    previous = {key(result): result["best"] for result in baseline}
+    return [
+        result for result in results
+        if key(result) in previous and result["best"] > previous[key(result)] * tolerance
+    ]
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="blender -b --factory-startup --python n32bt_bench.py --",
+        description="Time notester32's Bone Tool on synthetic armatures",
+    )
+    parser.add_argument("--shapes", nargs="+", choices=list(SHAPES), default=list(SHAPES))
+    parser.add_argument("--sizes", nargs="+", type=int, default=[100, 1000, 10000, 50000])
+    parser.add_argument("--mode", choices=list(core.ADJUSTMENT_ENDS), default="head_to_tail")
+    parser.add_argument("--reconnect", action="store_true")
+    parser.add_argument("--guard", choices=core.GUARD_POLICIES, default=core.DEFAULT_GUARD)
+    parser.add_argument("--mirror", action="store_true")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per operator, the best one is kept")
+    parser.add_argument("--cached-plans", action="store_true", help="Keep compiled plans between runs")
+    parser.add_argument("--workers", type=int, default=core.WORKERS, help="Threads for the compute of large forests")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Earlier results to compare against")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="Allowed slowdown against --compare")
+    return parser.parse_args(argv)
+
+def main():
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    args = parse_args(argv)
+    core.WORKERS = args.workers
+    results = run_benchmarks(args)
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({
+                "version": list(n32bt.bl_info["version"]),
+                "blender": bpy.app.version_string,
+                "mode": args.mode,
+                "reconnect": args.reconnect,
+                "guard": args.guard,
+                "mirror": args.mirror,
+                "workers": args.workers,
+                "results": results,
+            }, output, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            regressions = find_regressions(results, json.load(baseline)["results"], args.tolerance)
+        for result in regressions:
+            print("SLOWER  %(shape)s %(size)d %(operator)s %(phase)s: %(best).4fs" % result)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,414 @@
+"""A small stand-in for bpy, enough to run notester32's Bone Tool outside Blender.
+
+    import n32bt_fakebpy
+    bpy = n32bt_fakebpy.install()
+    import n32bt
+
+    n32bt.register()
+    armature = bpy.data.armatures.new("Armature")
+    obj = bpy.data.objects.new("Armature", armature)
+    bpy.context.view_layer.objects.active = obj
+    bpy.ops.object.mode_set(mode='EDIT')
+    ...
+    bpy.ops.armature.apply_all_bones()
+
+Only what the add-on, the batch script, the benchmarks and the tests use
+is there.
+Edit bones keep their values in per-collection lists, so foreach_get and
+foreach_set are bulk copies like in Blender and the engine can be
+profiled without Blender's startup time.
+"""
+
+import inspect
+import os
+import sys
+import types
+
+class Vector(tuple):
+    """Three floats, what edit bone heads and tails read back as"""
+
+    def __new__(cls, values=(0.0, 0.0, 0.0)):
+        return super().__new__(cls, (float(value) for value in values))
+
+class _Field:
+    """An edit bone property stored in a list of its collection"""
+
+    def __init__(self, convert=None):
+        self.convert = convert
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, bone, owner=None):
+        if bone is None:
+            return self
+        return bone.collection.fields[self.name][bone.index]
+
+    def __set__(self, bone, value):
+        bone.collection.fields[self.name][bone.index] = self.convert(value) if self.convert else value
+
+class EditBone:
+    head = _Field(Vector)
+    tail = _Field(Vector)
+    use_connect = _Field(bool)
+    select = _Field(bool)
+
+    def __init__(self, collection, index):
+        self.collection = collection
+        self.index = index
+
+    def __repr__(self):
+        return "<EditBone %r>" % self.name
+
+    @property
+    def id_data(self):
+        return self.collection.armature
+
+    @property
+    def name(self):
+        return self.collection.fields["name"][self.index]
+
+    @name.setter
+    def name(self, name):
+        self.collection.rename(self, name)
+
+    @property
+    def parent(self):
+        parent = self.collection.fields["parent"][self.index]
+        return None if parent is None else self.collection.bones[parent]
+
+    @parent.setter
+    def parent(self, bone):
+        # Like Blender, clearing the parent disconnects the bone and a parent below the bone is ignored
+        if bone is None:
+            self.collection.fields["use_connect"][self.index] = False
+        else:
+            ancestor = bone
+            while ancestor is not None:
+                if ancestor is self:
+                    return
+                ancestor = ancestor.parent
+        self.collection.fields["parent"][self.index] = None if bone is None else bone.index
+
+
+class EditBones:
+    """Stand-in for Armature.edit_bones"""
+
+    VECTORS = ("head", "tail")
+
+    def __init__(self, armature=None):
+        self.armature = armature
+        self.bones = []
+        self.index = {}
+        self.fields = {
+            "name": [],
+            "parent": [],
+            "head": [],
+            "tail": [],
+            "use_connect": [],
+            "select": [],
+        }
+        self.active = None
+
+    def __len__(self):
+        return len(self.bones)
+
+    def __iter__(self):
+        return iter(self.bones)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.bones[self.index[key]]
+        return self.bones[key]
+
+    def unique_name(self, name):
+        if name not in self.index:
+            return name
+        number = 1
+        while "%s.%03d" % (name, number) in self.index:
+            number += 1
+        return "%s.%03d" % (name, number)
+
+    def new(self, name):
+        bone = EditBone(self, len(self.bones))
+        name = self.unique_name(name)
+        defaults = {
+            "name": name,
+            "parent": None,
+            "head": Vector((0.0, 0.0, 0.0)),
+            "tail": Vector((0.0, 1.0, 0.0)),
+        }
+        for field, values in self.fields.items():
+            values.append(defaults.get(field, False))
+        self.bones.append(bone)
+        self.index[name] = bone.index
+        return bone
+
+    def rename(self, bone, name):
+        del self.index[bone.name]
+        name = self.unique_name(name)
+        self.fields["name"][bone.index] = name
+        self.index[name] = bone.index
+
+    def foreach_get(self, attribute, sequence):
+        values = self.fields[attribute]
+        if attribute in self.VECTORS:
+            values = [value for vector in values for value in vector]
+        sequence[:] = values
+
+    def foreach_set(self, attribute, sequence):
+        values = self.fields[attribute]
+        if attribute in self.VECTORS:
+            flat = [float(value) for value in sequence]
+            values[:] = [Vector(flat[i:i + 3]) for i in range(0, len(flat), 3)]
+        else:
+            values[:] = [bool(value) for value in sequence]
+
+class Bones:
+    """Stand-in for Armature.bones, the rest pose is kept in step with the edit bones"""
+
+    LOCAL = {"head_local": "head", "tail_local": "tail"}
+
+    def __init__(self, edit_bones):
+        self.edit_bones = edit_bones
+
+    def __len__(self):
+        return len(self.edit_bones)
+
+    def __iter__(self):
+        return iter(self.edit_bones)
+
+    def __getitem__(self, key):
+        return self.edit_bones[key]
+
+    def foreach_get(self, attribute, sequence):
+        self.edit_bones.foreach_get(self.LOCAL.get(attribute, attribute), sequence)
+
+class _IDCollection(dict):
+    """Stand-in for bpy.data collections"""
+
+    def __init__(self, factory):
+        super().__init__()
+        self.factory = factory
+
+    def __iter__(self):
+        return iter(self.values())
+
+    def new(self, name, *args):
+        item = self.factory(name, *args)
+        self[name] = item
+        return item
+
+    def remove(self, item):
+        del self[item.name]
+
+class Armature:
+    def __init__(self, name):
+        self.name = name
+        self.edit_bones = EditBones(self)
+        self.bones = Bones(self.edit_bones)
+
+class Object:
+    def __init__(self, name, data):
+        self.name = name
+        self.data = data
+        self.type = 'ARMATURE' if isinstance(data, Armature) else 'EMPTY'
+        self.mode = 'OBJECT'
+        self.selected = False
+
+    def select_set(self, state):
+        self.selected = state
+
+class _ObjectList(list):
+    def link(self, obj):
+        self.append(obj)
+
+class _LayerObjects(_ObjectList):
+    active = None
+
+class Scene:
+    """Registered scene properties are class attributes holding their default"""
+
+    def __init__(self):
+        self.collection = types.SimpleNamespace(objects=_ObjectList())
+
+    @property
+    def objects(self):
+        return self.collection.objects
+
+class WindowManager:
+    """Timers and modal handlers do nothing, a test sends the events to modal itself"""
+
+    def event_timer_add(self, time_step, window=None):
+        return types.SimpleNamespace(time_step=time_step)
+
+    def event_timer_remove(self, timer):
+        pass
+
+    def modal_handler_add(self, operator):
+        pass
+
+    def progress_begin(self, low, high):
+        pass
+
+    def progress_update(self, value):
+        pass
+
+    def progress_end(self):
+        pass
+
+class Context:
+    def __init__(self):
+        self.scene = Scene()
+        self.view_layer = types.SimpleNamespace(objects=_LayerObjects())
+        self.window_manager = WindowManager()
+        self.window = None
+        self.workspace = None
+
+    @property
+    def object(self):
+        return self.view_layer.objects.active
+
+    @property
+    def mode(self):
+        obj = self.object
+        return 'EDIT_ARMATURE' if obj and obj.mode == 'EDIT' else 'OBJECT'
+
+    @property
+    def selected_objects(self):
+        return [obj for obj in self.scene.objects if obj.selected]
+
+    @property
+    def objects_in_mode(self):
+        return [obj for obj in self.scene.objects if obj.mode == 'EDIT']
+
+    @property
+    def selected_editable_bones(self):
+        armatures = dict.fromkeys(obj.data for obj in self.objects_in_mode if obj.type == 'ARMATURE')
+        return [bone for data in armatures for bone in data.edit_bones if bone.select]
+
+class Operator:
+    bl_options = set()
+
+    def __init__(self):
+        self.reports = []
+        # Properties are annotations holding their default, like in Blender
+        for cls in reversed(type(self).__mro__):
+            for name, default in inspect.get_annotations(cls).items():
+                setattr(self, name, default)
+
+    def report(self, kind, message):
+        self.reports.append((set(kind), message))
+
+class Panel:
+    pass
+
+def _property(default=None, **options):
+    # The default is stored as the class attribute, instances override it
+    if default is None and "items" in options:
+        return options["items"][0][0]
+    return default
+
+class _OperatorCall:
+    def __init__(self, cls):
+        self.cls = cls
+
+    def __call__(self, **properties):
+        operator = self.cls()
+        for name, value in properties.items():
+            setattr(operator, name, value)
+        return operator.execute(_bpy.context)
+
+class _OperatorCategory:
+    def __init__(self):
+        self.operators = {}
+
+    def __getattr__(self, name):
+        try:
+            return self.operators[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+class _Ops:
+    def __init__(self):
+        self.categories = {}
+
+    def __getattr__(self, name):
+        return self.categories.setdefault(name, _OperatorCategory())
+
+    def add(self, cls):
+        category, name = cls.bl_idname.split(".")
+        getattr(self, category).operators[name] = _OperatorCall(cls)
+
+    def discard(self, cls):
+        category, name = cls.bl_idname.split(".")
+        getattr(self, category).operators.pop(name, None)
+
+def _mode_set(mode='OBJECT'):
+    # Like Blender, the selected objects of the active object's type enter Edit Mode with it
+    obj = _bpy.context.object
+    if obj is None:
+        raise RuntimeError("Operator bpy.ops.object.mode_set.poll() failed, context is incorrect")
+    objects = [obj]
+    if mode == 'EDIT':
+        objects += [other for other in _bpy.context.selected_objects if other.type == obj.type and other is not obj]
+    else:
+        objects += _bpy.context.objects_in_mode
+    for other in objects:
+        other.mode = mode
+    return {'FINISHED'}
+
+def _register_class(cls):
+    if hasattr(cls, "bl_idname") and issubclass(cls, Operator):
+        _bpy.ops.add(cls)
+
+def _unregister_class(cls):
+    if hasattr(cls, "bl_idname") and issubclass(cls, Operator):
+        _bpy.ops.discard(cls)
+
+def _build():
+    bpy = types.ModuleType("bpy")
+    bpy.types = types.SimpleNamespace(
+        Operator=Operator,
+        Panel=Panel,
+        Scene=Scene,
+        Object=Object,
+        Armature=Armature,
+        EditBone=EditBone,
+        WindowManager=WindowManager,
+    )
+    bpy.props = types.SimpleNamespace(
+        BoolProperty=_property,
+        EnumProperty=_property,
+        FloatProperty=_property,
+        PointerProperty=_property,
+        StringProperty=_property,
+    )
+    bpy.utils = types.SimpleNamespace(register_class=_register_class, unregister_class=_unregister_class)
+    bpy.path = types.SimpleNamespace(
+        abspath=lambda path: os.path.abspath(path[2:] if path.startswith("//") else path),
+        ensure_ext=lambda path, ext: path if path.lower().endswith(ext) else path + ext,
+    )
+    bpy.app = types.SimpleNamespace(
+        version_string="3.6.0 (n32bt_fakebpy)",
+        binary_path="",
+        handlers=types.SimpleNamespace(persistent=lambda handler: handler, depsgraph_update_post=[], load_post=[]),
+    )
+    bpy.ops = _Ops()
+    bpy.ops.object.operators["mode_set"] = _mode_set
+    bpy.data = types.SimpleNamespace(
+        armatures=_IDCollection(Armature),
+        objects=_IDCollection(Object),
+    )
+    bpy.context = Context()
+    return bpy
+
+_bpy = None
+
+def install():
+    """Puts the stand-in into sys.modules as bpy and returns it"""
+    global _bpy
+    if _bpy is None:
+        _bpy = _build()
+    sys.modules["bpy"] = _bpy
+    return _bpy
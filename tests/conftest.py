@@ -0,0 +1,70 @@
+"""Runs the tests under plain Python, with n32bt_fakebpy standing in for Blender"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import n32bt_fakebpy
+
+n32bt_fakebpy.install()
+
+import numpy as np
+import pytest
+
+import n32bt
+from n32bt import core
+from n32bt.core import BoneRecord
+
+@pytest.fixture
+def bpy():
+    """The fake bpy with the add-on registered, in an empty session"""
+    module = n32bt_fakebpy.install()
+    module.context = n32bt_fakebpy.Context()
+    module.data.armatures.clear()
+    module.data.objects.clear()
+    core.PLAN_CACHE.clear()
+    n32bt.register()
+    yield module
+    n32bt.unregister()
+
+def random_records(rng, count, roots=0.1, connected=0.5):
+    """A random rig whose parents come before their children, like the bones of most imports"""
+    records = []
+    tails = []
+    for bone in range(count):
+        parent = -1 if bone == 0 or rng.random() < roots else int(rng.integers(0, bone))
+        use_connect = parent >= 0 and rng.random() < connected
+        head = tails[parent] if use_connect else tuple(rng.normal(0.0, 1.0, 3).tolist())
+        tail = tuple((np.array(head) + rng.normal(0.0, 0.3, 3)).tolist())
+        tails.append(tail)
+        records.append(BoneRecord("b%d" % bone, "b%d" % parent if parent >= 0 else None, head, tail, use_connect))
+    return records
+
+def add_armature(bpy, name, records):
+    """Links a new armature object with the bones of records to the scene and selects it"""
+    data = bpy.data.armatures.new(name)
+    obj = bpy.data.objects.new(name, data)
+    bpy.context.scene.collection.objects.link(obj)
+    obj.select_set(True)
+    edit_bones = data.edit_bones
+    for record in records:
+        bone = edit_bones.new(record.name)
+        if record.parent is not None:
+            bone.parent = edit_bones[record.parent]
+        bone.head = record.head
+        bone.tail = record.tail
+        bone.use_connect = record.use_connect
+    return obj
+
+def edit(bpy, active):
+    """Puts the selected armatures in Edit Mode with active as the active object"""
+    bpy.context.view_layer.objects.active = active
+    bpy.ops.object.mode_set(mode='EDIT')
+
+def run(operator_class, context, **properties):
+    """Runs an operator's execute and returns its result and reports"""
+    operator = operator_class()
+    for name, value in properties.items():
+        setattr(operator, name, value)
+    return operator.execute(context), operator.reports
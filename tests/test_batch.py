@@ -0,0 +1,123 @@
+import json
+import os
+import stat
+import sys
+
+import pytest
+
+import n32bt_batch
+
+# Stands in for Blender running n32bt_batch.py --worker: every file is copied
+# to its output, and with --pipeline a session is recycled after 2 files
+STUB_WORKER = '''#!{python}
+import json
+import os
+import sys
+
+argv = sys.argv[sys.argv.index("--") + 1:]
+files = argv[argv.index("--worker") + 1:argv.index("--mode")]
+output_dir = argv[argv.index("--output-dir") + 1]
+input_root = argv[argv.index("--input-root") + 1]
+with open({sessions!r}, "a") as sessions:
+    sessions.write(" ".join(files) + "\\n")
+
+def fix(path):
+    output = os.path.join(output_dir, os.path.relpath(os.path.abspath(path), input_root))
+    result = {{"file": path, "output": output, "status": "ok", "dry_run": False, "stages": {{}}}}
+    result.update(armatures=1, bones=2, adjusted=1, guarded=0, load_time=0.0, fix_time=0.0, save_time=0.0)
+    with open(path, "rb") as source, open(output, "wb") as fixed:
+        fixed.write(source.read())
+    return result
+
+if "--pipeline" in argv:
+    for done, line in enumerate(sys.stdin, 1):
+        result = fix(line.rstrip("\\n"))
+        result.update(memory=0, recycled=done == 2)
+        print("N32BT_RESULT " + json.dumps(result), flush=True)
+        if result["recycled"]:
+            break
+else:
+    print("N32BT_RESULT " + json.dumps(fix(files[0])), flush=True)
+'''
+
+@pytest.fixture
+def batch(tmp_path):
+    """Runs n32bt_batch with the stub worker, returns the results of the summary and the worker sessions"""
+    stub = tmp_path / "blender"
+    sessions = tmp_path / "sessions.txt"
+    stub.write_text(STUB_WORKER.format(python=sys.executable, sessions=str(sessions)))
+    stub.chmod(stub.stat().st_mode | stat.S_IEXEC)
+
+    def run_batch(*argv):
+        summary = tmp_path / "summary.ndjson"
+        sessions.write_text("")
+        args = n32bt_batch.parse_args([
+            *argv, "--blender", str(stub), "--output-dir", str(tmp_path / "fixed"), "--summary", str(summary),
+        ])
+        code = n32bt_batch.run_batch(args)
+        results = [json.loads(line) for line in summary.read_text().splitlines()]
+        return code, {os.path.basename(result["file"]): result for result in results}, sessions.read_text().splitlines()
+    return run_batch
+
+def add_files(tmp_path, *names):
+    paths = []
+    for name in names:
+        path = tmp_path / "rigs" / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(name)
+        paths.append(str(path))
+    return paths
+
+def test_output_paths_keep_the_folders_below_the_input_root(tmp_path, batch):
+    files = add_files(tmp_path, "a/rig.fbx", "b/rig.fbx")
+    assert batch(*files)[0] == 0
+    assert (tmp_path / "fixed" / "a" / "rig.fbx").read_text() == "a/rig.fbx"
+    assert (tmp_path / "fixed" / "b" / "rig.fbx").read_text() == "b/rig.fbx"
+
+def test_cache_reuses_unchanged_files(tmp_path, batch):
+    files = add_files(tmp_path, "one.fbx", "two.fbx")
+    cache = str(tmp_path / "cache")
+    code, results, sessions = batch(*files, "--cache", cache)
+    assert code == 0 and len(sessions) == 2
+    assert not any(result.get("cached") for result in results.values())
+
+    (tmp_path / "fixed" / "one.fbx").unlink()
+    (tmp_path / "rigs" / "two.fbx").write_text("changed")
+    code, results, sessions = batch(*files, "--cache", cache)
+    assert code == 0 and sessions == [files[1]]
+    assert results["one.fbx"]["cached"] and not results["two.fbx"].get("cached")
+    assert (tmp_path / "fixed" / "one.fbx").read_text() == "one.fbx"
+    assert (tmp_path / "fixed" / "two.fbx").read_text() == "changed"
+
+def test_cache_evicts_down_to_its_size(tmp_path, batch):
+    files = add_files(tmp_path, "one.fbx")
+    cache = tmp_path / "cache"
+    assert batch(*files, "--cache", str(cache), "--cache-size", "0")[0] == 0
+    assert list(cache.iterdir()) == []
+
+def test_invalidate_drops_the_entries_of_the_files(tmp_path, batch, capsys):
+    files = add_files(tmp_path, "one.fbx", "two.fbx")
+    cache = str(tmp_path / "cache")
+    batch(*files, "--cache", cache)
+    args = n32bt_batch.parse_args([files[0], str(tmp_path / "missing.fbx"), "--cache", cache, "--invalidate"])
+    assert n32bt_batch.run_batch(args) == 1
+    assert "1 of 2 files dropped from the cache." in capsys.readouterr().out
+
+    code, results, sessions = batch(*files, "--cache", cache)
+    assert sessions == [files[0]]
+    assert results["two.fbx"]["cached"]
+
+def test_a_missing_file_fails_alone(tmp_path, batch):
+    files = add_files(tmp_path, "one.fbx")
+    code, results, _ = batch(*files, str(tmp_path / "rigs" / "missing.fbx"), "--cache", str(tmp_path / "cache"))
+    assert code == 1
+    assert results["one.fbx"]["status"] == "ok"
+    assert results["missing.fbx"]["status"] == "error"
+
+def test_pipeline_replaces_recycled_sessions(tmp_path, batch):
+    files = add_files(tmp_path, "one.fbx", "two.fbx", "three.fbx")
+    code, results, sessions = batch(*files, "--pipeline", "--jobs", "1")
+    assert code == 0
+    assert sessions == ["-", "-"]
+    assert all(result["status"] == "ok" for result in results.values())
+    assert sorted(os.listdir(tmp_path / "fixed")) == ["one.fbx", "three.fbx", "two.fbx"]
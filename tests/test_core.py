@@ -0,0 +1,334 @@
+import numpy as np
+import pytest
+
+from n32bt import core
+from n32bt.core import (
+    ADJUSTMENT_ENDS,
+    AdjustmentPlan,
+    BoneChains,
+    BoneRecord,
+    DeltaJournal,
+    SkeletonSnapshot,
+    all_bones_plan,
+    apply_plan,
+    descendants_plan,
+    fan_out_plan,
+    flip_name,
+    guard_bones,
+    mirror_index,
+    moved_subtrees,
+    nearest_points,
+)
+
+from conftest import random_records
+
+MODES = list(ADJUSTMENT_ENDS)
+
+def reference_adjust(snapshot, pairs, mode, reconnect):
+    """The old per-bone passes, one (source, target) pair at a time like setting EditBone.head, .tail and .use_connect.
+
+    A moved tail carries the heads of its connected children. A bone whose
+    head is set is let go of its parent first, so its parent's tail stays
+    (see "Connected bones" in the README), and reconnecting it puts its head
+    back on the parent's tail. A connected bone that stays connected drags
+    its parent's tail to its new head instead, unless it is set from that
+    parent.
+    """
+    target_end, source_end = ADJUSTMENT_ENDS[mode]
+    ends = [snapshot.heads.copy(), snapshot.tails.copy()]
+    heads, tails = ends
+    connect = snapshot.connect.copy()
+    parents = snapshot.parents
+    children = [np.flatnonzero(parents == bone) for bone in range(len(snapshot))]
+    for source, target in pairs:
+        value = ends[source_end][source].copy()
+        parent = parents[target]
+        if target_end == 0 and reconnect and connect[target] and parent >= 0 and source != parent:
+            heads[target] = value
+            tails[parent] = value
+            for child in children[parent]:
+                if connect[child]:
+                    heads[child] = value
+        elif target_end == 0:
+            connect[target] = False
+            heads[target] = value
+        else:
+            tails[target] = value
+            for child in children[target]:
+                if connect[child]:
+                    heads[child] = value
+        connect[target] = reconnect
+        if reconnect and parents[target] >= 0:
+            heads[target] = tails[parents[target]]
+    return heads, tails, connect
+
+def single_child_pairs(snapshot):
+    """The pairs of the old Apply to All Bones loop over the edit bones"""
+    parents = snapshot.parents.tolist()
+    pairs = []
+    for bone in range(len(snapshot)):
+        children = [child for child, parent in enumerate(parents) if parent == bone]
+        if len(children) == 1:
+            pairs.append((bone, children[0]))
+    return pairs
+
+def descendant_pairs(snapshot, root):
+    """The pairs of the old recursive Apply From Selected Bone"""
+    parents = snapshot.parents.tolist()
+    pairs = []
+    pending = [root]
+    while pending:
+        bone = pending.pop()
+        children = [child for child, parent in enumerate(parents) if parent == bone]
+        pairs.extend((bone, child) for child in children)
+        pending.extend(reversed(children))
+    return pairs
+
+def assert_matches(snapshot, expected):
+    heads, tails, connect = expected
+    np.testing.assert_allclose(snapshot.heads, heads, atol=1e-6)
+    np.testing.assert_allclose(snapshot.tails, tails, atol=1e-6)
+    np.testing.assert_array_equal(snapshot.connect, connect)
+
+@pytest.mark.parametrize("mode", MODES)
+@pytest.mark.parametrize("reconnect", [False, True])
+def test_all_bones_plan_matches_the_per_bone_passes(mode, reconnect):
+    rng = np.random.default_rng(1)
+    for _ in range(20):
+        snapshot = SkeletonSnapshot.from_records(random_records(rng, int(rng.integers(1, 60))))
+        expected = reference_adjust(snapshot, single_child_pairs(snapshot), mode, reconnect)
+        apply_plan(snapshot, all_bones_plan(snapshot, mode), reconnect)
+        assert_matches(snapshot, expected)
+
+@pytest.mark.parametrize("mode", MODES)
+@pytest.mark.parametrize("reconnect", [False, True])
+def test_descendants_plan_matches_the_recursive_walk(mode, reconnect):
+    rng = np.random.default_rng(2)
+    for _ in range(20):
+        snapshot = SkeletonSnapshot.from_records(random_records(rng, int(rng.integers(1, 60)), roots=0.0))
+        root = int(rng.integers(0, len(snapshot)))
+        expected = reference_adjust(snapshot, descendant_pairs(snapshot, root), mode, reconnect)
+        apply_plan(snapshot, descendants_plan(snapshot, root, mode), reconnect)
+        assert_matches(snapshot, expected)
+
+@pytest.mark.parametrize("mode", MODES)
+def test_leaf_first_reads_every_source_as_it_was(mode):
+    rng = np.random.default_rng(4)
+    for _ in range(20):
+        snapshot = SkeletonSnapshot.from_records(random_records(rng, int(rng.integers(1, 60)), roots=0.0, connected=0.0))
+        root = int(rng.integers(0, len(snapshot)))
+        # Children before their parents, so every parent is read before it is adjusted
+        expected = reference_adjust(snapshot, descendant_pairs(snapshot, root)[::-1], mode, False)
+        apply_plan(snapshot, descendants_plan(snapshot, root, mode, leaf_first=True), False)
+        assert_matches(snapshot, expected)
+
+@pytest.mark.parametrize("mode", MODES)
+@pytest.mark.parametrize("reconnect", [False, True])
+def test_fan_out_plan_matches_the_pairs_one_by_one(mode, reconnect):
+    rng = np.random.default_rng(3)
+    for _ in range(20):
+        snapshot = SkeletonSnapshot.from_records(random_records(rng, 40))
+        source = int(rng.integers(0, 40))
+        # Targets that are not each other's parents, so the pairs do not depend on their order
+        parents = snapshot.parents
+        targets = rng.choice(40, size=10, replace=False)
+        targets = [target for target in targets.tolist() if target != source]
+        targets = [target for target in targets if parents[target] not in targets]
+        expected = reference_adjust(snapshot, [(source, target) for target in targets], mode, reconnect)
+        plan = fan_out_plan(snapshot, "b%d" % source, ["b%d" % target for target in targets], mode)
+        apply_plan(snapshot, plan, reconnect)
+        assert_matches(snapshot, expected)
+
+def test_reconnecting_a_head_drags_the_parent_tail():
+    records = [
+        BoneRecord("p", None, (0.0, 0.0, 0.0), (0.0, 0.0, 1.0), False),
+        BoneRecord("t", "p", (0.0, 0.0, 1.0), (0.0, 0.0, 2.0), True),
+        BoneRecord("f", None, (1.0, 0.0, 0.0), (1.0, 0.0, 1.0), False),
+    ]
+    snapshot = SkeletonSnapshot.from_records(records)
+    apply_plan(snapshot, fan_out_plan(snapshot, "f", ["t"], "head_to_tail"), True)
+    np.testing.assert_array_equal(snapshot.heads[1], (1.0, 0.0, 1.0))
+    np.testing.assert_array_equal(snapshot.tails[0], (1.0, 0.0, 1.0))
+    assert snapshot.connect[1]
+
+def test_bone_chains_cover_the_bones_with_linear_chains():
+    rng = np.random.default_rng(4)
+    for _ in range(20):
+        snapshot = SkeletonSnapshot.from_records(random_records(rng, int(rng.integers(1, 80))))
+        parents = snapshot.parents
+        chains = BoneChains(snapshot.hierarchy)
+        child_counts = np.bincount(parents[parents >= 0], minlength=len(snapshot))
+
+        assert sorted(chains.bones.tolist()) == list(range(len(snapshot)))
+        for chain in range(len(chains)):
+            bones = chains.chain(chain)
+            head = bones[0]
+            assert parents[head] < 0 or child_counts[parents[head]] != 1
+            for above, below in zip(bones[:-1], bones[1:]):
+                assert parents[below] == above and child_counts[above] == 1
+            assert np.array_equal(chains.chain_of[bones], np.full(len(bones), chain))
+        assert np.array_equal(chains.branch_points, np.flatnonzero(child_counts > 1))
+
+def test_preorder_slices_are_the_subtrees():
+    rng = np.random.default_rng(5)
+    snapshot = SkeletonSnapshot.from_records(random_records(rng, 80))
+    parents = snapshot.parents.tolist()
+    bones, starts, ends = snapshot.chains.preorder
+    for bone in range(len(snapshot)):
+        below = {bone}
+        for other in range(len(snapshot)):
+            ancestor = other
+            while ancestor >= 0 and ancestor != bone:
+                ancestor = parents[ancestor]
+            if ancestor == bone:
+                below.add(other)
+        assert set(bones[starts[bone]:ends[bone]].tolist()) == below
+
+@pytest.mark.parametrize("shuffle", [False, True])
+def test_subtree_split_matches_the_single_pass(monkeypatch, shuffle):
+    rng = np.random.default_rng(6)
+    records = random_records(rng, 400, roots=0.05)
+    if shuffle:
+        records = [records[0]] + [records[i] for i in rng.permutation(np.arange(1, len(records)))]
+    for mode in MODES:
+        whole = SkeletonSnapshot.from_records(records)
+        apply_plan(whole, all_bones_plan(whole, mode), True)
+
+        monkeypatch.setattr(core, "WORKERS", 3)
+        monkeypatch.setattr(core, "PARALLEL_MIN_BONES", 1)
+        monkeypatch.setattr(core, "COMPUTE_POOL", None)
+        split = SkeletonSnapshot.from_records(records)
+        core.PROFILER.start("split")
+        apply_plan(split, all_bones_plan(split, mode), True)
+        assert core.PROFILER.stop()["counters"]["subtree_groups"] == 3
+        monkeypatch.undo()
+        assert_matches(split, (whole.heads, whole.tails, whole.connect))
+
+def test_moved_subtrees_are_the_moved_bones_and_their_descendants():
+    rng = np.random.default_rng(7)
+    records = random_records(rng, 100)
+    last = SkeletonSnapshot.from_records(records)
+    snapshot = SkeletonSnapshot.from_records(records)
+    moved = rng.choice(100, size=5, replace=False)
+    snapshot.tails = snapshot.tails.copy()
+    snapshot.tails[moved] += 1.0
+
+    bones = moved_subtrees(snapshot, last).tolist()
+    parents = snapshot.parents.tolist()
+    expected = set()
+    for bone in range(100):
+        ancestor = bone
+        while ancestor >= 0 and ancestor not in moved:
+            ancestor = parents[ancestor]
+        if ancestor >= 0:
+            expected.add(bone)
+    assert sorted(bones) == sorted(expected)
+    # Depth first, a parent comes before its children
+    seen = set()
+    for bone in bones:
+        assert parents[bone] not in expected or parents[bone] in seen
+        seen.add(bone)
+
+def test_apply_plan_below_matches_the_whole_plan():
+    rng = np.random.default_rng(8)
+    records = random_records(rng, 200)
+    last = SkeletonSnapshot.from_records(records)
+    apply_plan(last, all_bones_plan(last, "head_to_tail"), False)
+    adjusted = list(last.records())
+
+    snapshot = SkeletonSnapshot.from_records(adjusted)
+    snapshot.tails = snapshot.tails.copy()
+    snapshot.tails[[3, 50]] += 0.5
+    whole = SkeletonSnapshot.from_records(snapshot.records())
+    apply_plan(whole, all_bones_plan(whole, "head_to_tail"), False)
+    apply_plan(snapshot, all_bones_plan(snapshot, "head_to_tail"), False, moved_subtrees(snapshot, last))
+    assert_matches(snapshot, (whole.heads, whole.tails, whole.connect))
+
+def test_flip_name():
+    assert flip_name("hand.L") == "hand.R"
+    assert flip_name("hand_r.001") == "hand_l.001"
+    assert flip_name("L_hand") == "R_hand"
+    assert flip_name("LeftHand") == "RightHand"
+    assert flip_name("spine") is None
+
+def test_mirror_index_pairs_by_name_then_by_position():
+    snapshot = SkeletonSnapshot.from_records([
+        BoneRecord("spine", None, (0.0, 0.0, 0.0), (0.0, 0.0, 1.0), False),
+        BoneRecord("arm.L", "spine", (0.2, 0.0, 1.0), (1.0, 0.0, 1.0), False),
+        BoneRecord("arm.R", "spine", (-0.2, 0.0, 1.0), (-1.0, 0.0, 1.0), False),
+        BoneRecord("strap1", "spine", (0.5, 0.3, 0.5), (0.6, 0.3, 0.0), False),
+        BoneRecord("strap2", "spine", (-0.5, 0.3, 0.5), (-0.6, 0.3, 0.0), False),
+        BoneRecord("tassel", "spine", (0.7, 0.0, 0.0), (0.7, 0.0, -1.0), False),
+    ])
+    assert mirror_index(snapshot).tolist() == [0, 2, 1, 4, 3, -1]
+
+def test_guard_policies():
+    records = [
+        BoneRecord("parent", None, (0.0, 0.0, 0.0), (0.0, 0.0, 1.0), False),
+        BoneRecord("child", "parent", (0.0, 0.0, 2.0), (0.0, 0.0, 1.0), False),
+    ]
+    for policy, head, tail in (
+        ("skip", (0.0, 0.0, 2.0), (0.0, 0.0, 1.0)),
+        ("keep_length", (0.0, 0.0, 1.0), (0.0, 0.0, 0.0)),
+        ("report", (0.0, 0.0, 1.0), (0.0, 0.0, 1.0)),
+    ):
+        snapshot = SkeletonSnapshot.from_records(records)
+        plan = all_bones_plan(snapshot, "head_to_tail")
+        apply_plan(snapshot, plan, False)
+        assert guard_bones(snapshot, policy, plan.target_end).tolist() == [1]
+        assert snapshot.heads[1].tolist() == list(head)
+        assert snapshot.tails[1].tolist() == list(tail)
+
+def test_nearest_points_matches_a_brute_force_search():
+    rng = np.random.default_rng(9)
+    for _ in range(20):
+        count = int(rng.integers(1, 200))
+        points = rng.random((count, 3)).astype(np.float32)
+        points[rng.random(count) < 0.3] = 0.0
+        # A dense cell of distinct points, smaller than the tolerance
+        dense = rng.random(count) < 0.3
+        points[dense] = 0.5 + 0.01 * rng.random((dense.sum(), 3))
+        queries = rng.random((count, 3)).astype(np.float32)
+        queries[::2] = points[::2]
+        exclude = np.arange(count)
+        nearest = nearest_points(points, queries, 0.1, exclude)
+
+        distances = np.linalg.norm(points[None] - queries[:, None], axis=2)
+        distances[exclude, exclude] = np.inf
+        best = distances.min(axis=1)
+        assert np.array_equal(nearest >= 0, best <= 0.1)
+        found = np.flatnonzero(nearest >= 0)
+        np.testing.assert_allclose(distances[found, nearest[found]], best[found], atol=1e-6)
+
+def test_nearest_points_in_a_crowded_cell():
+    points = np.zeros((12, 3))
+    points[:, 0] = np.arange(12) * 0.0005
+    nearest = nearest_points(points, points[11:], 0.01)
+    assert nearest.tolist() == [11]
+
+def test_nearest_points_with_coincident_points():
+    points = np.zeros((20000, 3), dtype=np.float32)
+    nearest = nearest_points(points, points, 0.01, exclude=np.arange(len(points)))
+    assert np.all(nearest >= 0) and np.all(nearest != np.arange(len(points)))
+
+def test_journal_round_trip(tmp_path):
+    rng = np.random.default_rng(10)
+    records = random_records(rng, 30)
+    snapshot = SkeletonSnapshot.from_records(records)
+    apply_plan(snapshot, all_bones_plan(snapshot, "tail_to_head"), True)
+    recipe = snapshot.recipe()
+    recipe.save(str(tmp_path / "recipe.npz"))
+    loaded = DeltaJournal.load(str(tmp_path / "recipe.npz"))
+
+    copy = SkeletonSnapshot.from_records(records)
+    assert loaded.apply(copy) == []
+    assert_matches(copy, (snapshot.heads, snapshot.tails, snapshot.connect))
+
+def test_compile_reads_adjusted_sources():
+    snapshot = SkeletonSnapshot.from_records([
+        BoneRecord("a", None, (0.0, 0.0, 0.0), (0.0, 0.0, 1.0), False),
+        BoneRecord("b", "a", (5.0, 0.0, 0.0), (5.0, 0.0, 1.0), False),
+        BoneRecord("c", "b", (9.0, 0.0, 0.0), (9.0, 0.0, 1.0), False),
+    ])
+    apply_plan(snapshot, AdjustmentPlan.compile(3, [1, 0], [2, 1], "head_to_head"), False)
+    assert snapshot.heads.tolist() == [[0.0, 0.0, 0.0]] * 3
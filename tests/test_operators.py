@@ -0,0 +1,415 @@
+import json
+import logging
+import types
+
+import numpy as np
+
+import n32bt
+from n32bt.core import (
+    PLAN_CACHE,
+    PROFILER,
+    BoneRecord,
+    SkeletonSnapshot,
+    adjustment_steps,
+    all_bones_plan,
+    all_bones_plan_steps,
+    apply_plan,
+    finish,
+)
+
+from conftest import add_armature, edit, random_records, run
+
+def adjusted_records(records, mode="head_to_tail"):
+    snapshot = SkeletonSnapshot.from_records(records)
+    apply_plan(snapshot, all_bones_plan(snapshot, mode), False)
+    return list(snapshot.records())
+
+def bone_values(obj):
+    return SkeletonSnapshot.from_edit_bones(obj.data.edit_bones)
+
+def assert_bones(obj, records):
+    snapshot = bone_values(obj)
+    expected = SkeletonSnapshot.from_records(records)
+    np.testing.assert_allclose(snapshot.heads, expected.heads, atol=1e-6)
+    np.testing.assert_allclose(snapshot.tails, expected.tails, atol=1e-6)
+    np.testing.assert_array_equal(snapshot.connect, expected.connect)
+
+def test_apply_all_bones_adjusts_every_armature_in_edit_mode(bpy):
+    rng = np.random.default_rng(1)
+    first = random_records(rng, 50)
+    second = random_records(rng, 30)
+    bpy.context.scene.adjust_bones_guard = "report"
+    objects = [add_armature(bpy, "First", first), add_armature(bpy, "Second", second)]
+    edit(bpy, objects[0])
+
+    result, reports = run(n32bt.ApplyAllBonesOperator, bpy.context)
+    assert result == {'FINISHED'}
+    assert_bones(objects[0], adjusted_records(first))
+    assert_bones(objects[1], adjusted_records(second))
+    assert set(n32bt.JOURNALS) == {"First", "Second"}
+    assert reports[-1][1].endswith("in 2 armatures.")
+
+def test_plans_of_many_armatures_stay_cached(bpy):
+    rng = np.random.default_rng(9)
+    objects = [add_armature(bpy, "Armature%d" % i, random_records(rng, 20)) for i in range(40)]
+    edit(bpy, objects[0])
+    bpy.context.scene.adjust_bones_mirror = True
+
+    run(n32bt.ApplyAllBonesOperator, bpy.context)
+    misses = PLAN_CACHE.misses
+    run(n32bt.ApplyAllBonesOperator, bpy.context)
+    assert PLAN_CACHE.misses == misses
+
+def test_dry_run_writes_records_and_changes_nothing(bpy, tmp_path):
+    rng = np.random.default_rng(2)
+    records = random_records(rng, 40)
+    bpy.context.scene.adjust_bones_guard = "report"
+    obj = add_armature(bpy, "Armature", records)
+    edit(bpy, obj)
+
+    path = tmp_path / "changes.ndjson"
+    result, _ = run(n32bt.ApplyAllBonesOperator, bpy.context, dry_run=True, dry_run_path=str(path))
+    assert result == {'CANCELLED'}
+    assert_bones(obj, records)
+    assert not n32bt.JOURNALS
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    journal = bone_values(obj)
+    apply_plan(journal, all_bones_plan(journal, "head_to_tail"), False)
+    assert len(lines) == len(journal.pending_journal())
+    assert {"armature", "bone", "old_head", "new_head", "head_displacement"} <= set(lines[0])
+
+def test_dry_run_to_a_bad_path_warns(bpy, tmp_path):
+    rng = np.random.default_rng(2)
+    records = random_records(rng, 10)
+    obj = add_armature(bpy, "Armature", records)
+    edit(bpy, obj)
+
+    path = tmp_path / "missing" / "changes.ndjson"
+    result, reports = run(n32bt.ApplyAllBonesOperator, bpy.context, dry_run=True, dry_run_path=str(path))
+    assert result == {'CANCELLED'}
+    assert reports[-1][0] == {'WARNING'}
+    assert reports[-1][1].startswith("Could not write the dry run: ")
+    assert_bones(obj, records)
+
+def test_toggle_and_revert_the_last_adjustment(bpy):
+    rng = np.random.default_rng(3)
+    records = random_records(rng, 40)
+    bpy.context.scene.adjust_bones_guard = "report"
+    obj = add_armature(bpy, "Armature", records)
+    edit(bpy, obj)
+    run(n32bt.ApplyAllBonesOperator, bpy.context)
+
+    run(n32bt.ToggleAdjustmentOperator, bpy.context)
+    assert_bones(obj, records)
+    run(n32bt.ToggleAdjustmentOperator, bpy.context)
+    assert_bones(obj, adjusted_records(records))
+    result, _ = run(n32bt.RevertAdjustmentOperator, bpy.context)
+    assert result == {'FINISHED'}
+    assert_bones(obj, records)
+    assert n32bt.last_journal(obj) is None
+
+def test_recipe_replays_on_a_re_export(bpy, tmp_path):
+    rng = np.random.default_rng(4)
+    records = random_records(rng, 40)
+    bpy.context.scene.adjust_bones_guard = "report"
+    fixed = add_armature(bpy, "Fixed", records)
+    edit(bpy, fixed)
+    run(n32bt.ApplyAllBonesOperator, bpy.context)
+    path = str(tmp_path / "rig.npz")
+    result, _ = run(n32bt.ExportRecipeOperator, bpy.context, filepath=path)
+    assert result == {'FINISHED'}
+
+    bpy.ops.object.mode_set(mode='OBJECT')
+    fixed.select_set(False)
+    # The re-export lost a bone the recipe has
+    reexport = add_armature(bpy, "Reexport", records[:-1])
+    edit(bpy, reexport)
+    result, reports = run(n32bt.ApplyRecipeOperator, bpy.context, filepath=path)
+    assert result == {'FINISHED'}
+    assert_bones(reexport, adjusted_records(records)[:-1])
+    assert reports[0] == ({'WARNING'}, "1 recipe bones not found: %s" % records[-1].name)
+
+def test_apply_adjustment_on_a_pair_per_armature(bpy):
+    records = [
+        BoneRecord("a", None, (0.0, 0.0, 0.0), (0.0, 0.0, 1.0), False),
+        BoneRecord("b", None, (3.0, 0.0, 0.0), (3.0, 0.0, 1.0), False),
+    ]
+    objects = [add_armature(bpy, "First", records), add_armature(bpy, "Second", records)]
+    edit(bpy, objects[0])
+    for obj in objects:
+        for bone in obj.data.edit_bones:
+            bone.select = True
+
+    result, reports = run(n32bt.AdjustBonesOperator, bpy.context)
+    assert result == {'FINISHED'}
+    for obj in objects:
+        assert tuple(obj.data.edit_bones["b"].head) == (0.0, 0.0, 1.0)
+    assert reports == [({'INFO'}, "Adjusted 2 bones in 2 armatures.")]
+
+def test_guarded_bones_are_named_with_their_armature(bpy):
+    records = [
+        BoneRecord("b8", None, (0.0, 0.0, 0.0), (0.0, 0.0, 1.0), False),
+        BoneRecord("b9", "b8", (0.0, 0.0, 3.0), (0.0, 0.0, 1.0), False),
+    ]
+    objects = [add_armature(bpy, "A", records), add_armature(bpy, "B", records)]
+    edit(bpy, objects[0])
+
+    result, reports = run(n32bt.ApplyAllBonesOperator, bpy.context)
+    assert result == {'CANCELLED'}
+    assert reports[0] == ({'WARNING'}, "2 bones would collapse or flip (see Guard): A/b9, B/b9")
+
+def test_summary_counts_the_bones_apply_to_all_bones_moves(bpy):
+    records = [
+        BoneRecord("b8", None, (0.0, 0.0, 0.0), (0.0, 0.0, 1.0), False),
+        BoneRecord("b9", "b8", (0.0, 0.0, 3.0), (0.0, 0.0, 1.0), False),
+    ]
+    obj = add_armature(bpy, "Armature", records)
+    edit(bpy, obj)
+    scene = bpy.context.scene
+
+    summary = n32bt.armature_summary(bpy.context, obj)
+    assert (summary.pending, summary.collapsing) == (0, 1)
+    scene.adjust_bones_guard = "report"
+    summary = n32bt.armature_summary(bpy.context, obj)
+    assert (summary.pending, summary.collapsing) == (1, 1)
+
+    rng = np.random.default_rng(10)
+    obj = add_armature(bpy, "Random", random_records(rng, 60))
+    edit(bpy, obj)
+    scene.adjust_bones_mirror = True
+    pending = n32bt.armature_summary(bpy.context, obj).pending
+    run(n32bt.ApplyAllBonesOperator, bpy.context)
+    assert len(n32bt.last_journal(obj)) == pending
+
+def test_align_to_reference_matches_stripped_names(bpy):
+    clean = add_armature(bpy, "Clean", [
+        BoneRecord("hips", None, (0.0, 0.0, 1.0), (0.0, 0.0, 1.2), False),
+        BoneRecord("spine", "hips", (0.0, 0.0, 1.2), (0.0, 0.0, 1.6), True),
+        BoneRecord("hand", None, (0.0, 0.0, 5.0), (0.0, 0.0, 5.5), False),
+    ])
+    clean.select_set(False)
+    records = [
+        BoneRecord("mixamorig:hips", None, (0.1, 0.0, 1.0), (0.1, 0.0, 1.3), False),
+        BoneRecord("mixamorig:spine", "mixamorig:hips", (0.1, 0.0, 1.25), (0.0, 0.0, 1.6), False),
+        BoneRecord("mixamorig:hand", None, (0.0, 0.0, 0.0), (0.0, 0.0, 1.0), False),
+        BoneRecord("mixamorig:prop", None, (1.0, 0.0, 0.0), (1.0, 0.0, 1.0), False),
+    ]
+    broken = add_armature(bpy, "Broken", records)
+    edit(bpy, broken)
+    scene = bpy.context.scene
+    scene.adjust_bones_mode = "head_to_head"
+    scene.adjust_bones_reference = clean
+    scene.adjust_bones_strip_prefixes = "mixamorig:"
+
+    result, reports = run(n32bt.AlignToReferenceOperator, bpy.context)
+    assert result == {'FINISHED'}
+    # The head of hand would go past its tail, so the guard skips it
+    assert_bones(broken, [
+        records[0]._replace(head=(0.0, 0.0, 1.0)),
+        records[1]._replace(head=(0.0, 0.0, 1.2)),
+        records[2],
+        records[3],
+    ])
+    assert reports == [
+        ({'WARNING'}, "1 bones have no match in the reference: mixamorig:prop"),
+        ({'WARNING'}, "1 bones would collapse or flip (see Guard): mixamorig:hand"),
+        ({'INFO'}, "Adjusted 2 bones."),
+    ]
+
+def test_mirror_adjusts_one_side_and_mirrors_it(bpy):
+    records = [
+        BoneRecord("spine", None, (0.0, 0.0, 0.0), (0.0, 0.0, 1.0), False),
+        BoneRecord("upper.L", "spine", (0.3, 0.0, 1.0), (0.6, 0.0, 1.0), False),
+        BoneRecord("lower.L", "upper.L", (0.65, 0.0, 1.0), (0.9, 0.0, 1.0), False),
+        BoneRecord("upper.R", "spine", (-0.3, 0.0, 1.0), (-0.6, 0.0, 1.0), False),
+        BoneRecord("lower.R", "upper.R", (-0.7, 0.0, 1.1), (-0.9, 0.0, 1.2), False),
+        BoneRecord("bag", None, (0.5, 0.3, 0.0), (0.5, 0.3, -0.5), False),
+        BoneRecord("strap", "bag", (0.55, 0.3, -0.5), (0.6, 0.3, -1.0), False),
+    ]
+    obj = add_armature(bpy, "Armature", records)
+    edit(bpy, obj)
+    bpy.context.scene.adjust_bones_mirror = True
+
+    result, reports = run(n32bt.ApplyAllBonesOperator, bpy.context)
+    assert result == {'FINISHED'}
+    assert_bones(obj, [
+        *records[:2],
+        records[2]._replace(head=(0.6, 0.0, 1.0)),
+        records[3],
+        records[4]._replace(head=(-0.6, 0.0, 1.0), tail=(-0.9, 0.0, 1.0)),
+        records[5],
+        records[6]._replace(head=(0.5, 0.3, -0.5)),
+    ])
+    assert reports == [
+        ({'WARNING'}, "1 adjusted bones have no mirror bone: strap"),
+        ({'INFO'}, "Adjusted 3 bones."),
+    ]
+
+def test_snap_re_parents_a_swapped_parent_and_child(bpy):
+    records = [
+        BoneRecord("a", None, (0.0, 0.0, 2.0), (0.0, 0.0, 3.0), False),
+        BoneRecord("b", "a", (0.0, 0.0, 1.0), (0.0, 0.0, 2.0), False),
+        BoneRecord("c", None, (0.0, 0.0, 0.0), (0.0, 0.0, 1.0), False),
+    ]
+    obj = add_armature(bpy, "Armature", records)
+    edit(bpy, obj)
+    bpy.context.scene.adjust_bones_snap_reparent = True
+
+    result, _ = run(n32bt.SnapToNearestJointOperator, bpy.context)
+    assert result == {'FINISHED'}
+    parents = {bone.name: bone.parent.name if bone.parent else None for bone in obj.data.edit_bones}
+    assert parents == {"a": "b", "b": "c", "c": None}
+
+def test_snap_and_recipes_are_guarded(bpy, tmp_path):
+    records = [
+        BoneRecord("x", None, (0.0, 0.0, 0.0), (0.0, 0.0, 1.005), False),
+        BoneRecord("b", None, (0.0, 0.0, 1.0), (0.0, 0.0, 1.004), False),
+    ]
+    obj = add_armature(bpy, "Armature", records)
+    edit(bpy, obj)
+    bpy.context.scene.adjust_bones_snap_tolerance = 0.01
+
+    # Snapping the head of b onto the tail of x would turn b around
+    result, reports = run(n32bt.SnapToNearestJointOperator, bpy.context)
+    assert result == {'CANCELLED'}
+    assert reports[0] == ({'WARNING'}, "1 bones would collapse or flip (see Guard): b")
+    assert_bones(obj, records)
+
+    flipped = [records[0], records[1]._replace(head=records[1].tail, tail=records[1].head)]
+    path = str(tmp_path / "flipped.npz")
+    SkeletonSnapshot.from_records(flipped).recipe().save(path)
+    result, reports = run(n32bt.ApplyRecipeOperator, bpy.context, filepath=path)
+    assert result == {'CANCELLED'}
+    assert reports[0] == ({'WARNING'}, "1 bones would collapse or flip (see Guard): b")
+    assert_bones(obj, records)
+
+def test_live_re_apply_follows_re_parented_and_renamed_bones(bpy):
+    records = [
+        BoneRecord("a", None, (0.0, 0.0, 0.0), (0.0, 0.0, 1.0), False),
+        BoneRecord("b", "a", (0.0, 0.0, 1.0), (0.0, 0.0, 2.0), True),
+        BoneRecord("c", None, (2.0, 0.0, 0.0), (2.0, 0.0, 1.0), False),
+    ]
+    obj = add_armature(bpy, "Armature", records)
+    edit(bpy, obj)
+    bpy.context.scene.adjust_bones_live = True
+    edit_bones = obj.data.edit_bones
+    depsgraph = types.SimpleNamespace(updates=[types.SimpleNamespace(id=obj.data)])
+    n32bt.reapply_live(bpy.context.scene, depsgraph)
+
+    edit_bones["b"].parent = edit_bones["c"]
+    edit_bones["b"].tail = (2.0, 0.0, 2.0)
+    n32bt.reapply_live(bpy.context.scene, depsgraph)
+    assert tuple(edit_bones["b"].head) == (2.0, 0.0, 1.0)
+
+    edit_bones["b"].name = "d"
+    n32bt.reapply_live(bpy.context.scene, depsgraph)
+    assert n32bt.LIVE["Armature"][1].names == ["a", "d", "c"]
+    edit_bones["c"].tail = (2.0, 0.0, 1.5)
+    n32bt.reapply_live(bpy.context.scene, depsgraph)
+    assert tuple(edit_bones["d"].head) == (2.0, 0.0, 1.5)
+    assert tuple(edit_bones["a"].tail) == (0.0, 0.0, 1.0)
+
+def test_profile_times_every_phase_of_a_run(bpy, monkeypatch, caplog):
+    monkeypatch.setattr(n32bt, "STEP_TIME", 0.0)
+    caplog.set_level(logging.INFO, logger="n32bt.core")
+    rng = np.random.default_rng(11)
+    obj = add_armature(bpy, "Armature", random_records(rng, 40))
+    edit(bpy, obj)
+    bpy.context.scene.adjust_bones_profile = True
+
+    run(n32bt.ApplyAllBonesOperator, bpy.context)
+    assert PROFILER.last["name"] == "armature.apply_all_bones"
+    assert {"read", "plan", "adjust", "guard", "write"} <= set(PROFILER.last["phases"])
+    assert PROFILER.last["counters"]["bones_read"] == 40
+    assert caplog.records[-1].getMessage().startswith("armature.apply_all_bones: ")
+
+    # A background run adds up its phases over the timer events
+    bpy.ops.armature.revert_adjustment()
+    assert run_in_background(n32bt.ApplyAllBonesOperator(), bpy.context, ['TIMER'] * 100) == {'FINISHED'}
+    assert PROFILER.last["counters"]["bones_read"] == 40
+    assert not PROFILER.enabled
+
+def test_loading_a_file_forgets_the_journals(bpy):
+    rng = np.random.default_rng(5)
+    obj = add_armature(bpy, "Armature", random_records(rng, 20))
+    edit(bpy, obj)
+    run(n32bt.ApplyAllBonesOperator, bpy.context)
+    assert n32bt.last_journal(obj) is not None
+
+    for handler in bpy.app.handlers.load_post:
+        handler(None)
+    assert n32bt.last_journal(obj) is None
+
+def run_in_background(operator, context, events):
+    """Invokes a ChunkedAdjustment with "Run in Background" and sends it the events, returns the last result"""
+    context.scene.adjust_bones_background = True
+    result = operator.invoke(context, None)
+    for event in events:
+        if result != {'RUNNING_MODAL'}:
+            break
+        result = operator.modal(context, types.SimpleNamespace(type=event))
+    return result
+
+def test_background_run_adjusts_over_timer_events(bpy, monkeypatch):
+    monkeypatch.setattr(n32bt, "STEP_TIME", 0.0)
+    rng = np.random.default_rng(6)
+    first = random_records(rng, 50)
+    second = random_records(rng, 30)
+    bpy.context.scene.adjust_bones_guard = "report"
+    objects = [add_armature(bpy, "First", first), add_armature(bpy, "Second", second)]
+    edit(bpy, objects[0])
+
+    operator = n32bt.ApplyAllBonesOperator()
+    assert run_in_background(operator, bpy.context, ['TIMER'] * 100) == {'FINISHED'}
+    assert_bones(objects[0], adjusted_records(first))
+    assert_bones(objects[1], adjusted_records(second))
+
+def test_esc_reverts_the_armatures_already_adjusted(bpy, monkeypatch):
+    monkeypatch.setattr(n32bt, "STEP_TIME", 0.0)
+    rng = np.random.default_rng(7)
+    first = random_records(rng, 50)
+    second = random_records(rng, 30)
+    bpy.context.scene.adjust_bones_guard = "report"
+    objects = [add_armature(bpy, "First", first), add_armature(bpy, "Second", second)]
+    edit(bpy, objects[0])
+
+    operator = n32bt.ApplyAllBonesOperator()
+    assert run_in_background(operator, bpy.context, []) == {'RUNNING_MODAL'}
+    # Step until the first armature is written
+    original = SkeletonSnapshot.from_records(first).heads
+    while np.array_equal(bone_values(objects[0]).heads, original):
+        assert operator.modal(bpy.context, types.SimpleNamespace(type='TIMER')) == {'RUNNING_MODAL'}
+    assert operator.modal(bpy.context, types.SimpleNamespace(type='ESC')) == {'CANCELLED'}
+    assert_bones(objects[0], first)
+    assert_bones(objects[1], second)
+    assert not n32bt.JOURNALS
+
+class FreedAfterReading:
+    """Edit bones that are freed after the first step, like undo frees them between two timer events"""
+
+    def __init__(self, edit_bones):
+        self.edit_bones = edit_bones
+        self.freed = False
+
+    def __len__(self):
+        return len(self.edit_bones)
+
+    def __iter__(self):
+        for bone in self.edit_bones:
+            assert not self.freed, "an edit bone was read after the first step"
+            yield bone
+
+    def __getattr__(self, name):
+        return getattr(self.edit_bones, name)
+
+def test_adjustment_steps_hold_no_edit_bone_across_steps(bpy):
+    rng = np.random.default_rng(8)
+    records = random_records(rng, 3000)
+    obj = add_armature(bpy, "Armature", records)
+    edit_bones = FreedAfterReading(obj.data.edit_bones)
+
+    steps = adjustment_steps(edit_bones, lambda snapshot: all_bones_plan_steps(snapshot, "head_to_tail"), False)
+    next(steps)
+    edit_bones.freed = True
+    journal = finish(steps)
+    assert len(journal) > 0